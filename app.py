@@ -11,26 +11,37 @@
 #
 # Then run: python app.py
 
-from flask import Flask, render_template_string, request, redirect, url_for, session, send_file, flash, jsonify
+from flask import Flask, Response, request, redirect, url_for, session, flash, jsonify, stream_with_context, g, has_app_context
 import os
 import io
 import re
-import glob
-import statistics
+import csv
+import queue
+import atexit
+import threading
 import hashlib
-import pickle
+import hmac
+import time
+import joblib
 import base64
+import functools
+import contextlib
+import textwrap
+import collections
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime
 from PIL import Image
 import numpy as np
 import cv2
-import pandas as pd
 from jinja2 import DictLoader, ChoiceLoader  # in-memory templates
+from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.sansio.multipart import MultipartDecoder, Field, File, Data, Epilogue, NeedData
 
 # local imports (assume trainer.py, utils.py and db.py exist)
-from trainer import train_model
+from trainer import train_model, read_gray_image
 from utils import ensure_directories
-from db import get_conn, test_connection, get_conn as get_mysql_conn
+# get_conn() checks out of the shared pool in db.py; conn.close() returns it
+from db import get_conn, test_connection, unbuffered_cursor, get_conn as get_mysql_conn
 
 # initialize folders
 ensure_directories()
@@ -39,39 +50,176 @@ MODEL_PATH = "models/trained_model.yml"
 SKLEARN_MODEL_PATH = "models/sklearn_model.pkl"
 CONFIDENCE_THRESHOLD = 100
 SKLEARN_PROBA_THRESHOLD = 0.80
+# LBP cascade is much faster than Haar; pip wheels of opencv only ship the
+# haarcascades folder, so the LBP file (from OpenCV 4.10's data/lbpcascades) lives
+# in the repo. Haar stays as the fallback if it is missing or fails to load.
+LBP_CASCADE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cascades", "lbpcascade_frontalface_improved.xml")
+HAAR_CASCADE_PATH = cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
+FACE_MIN_SIZE = (80, 80)
+# detection runs on a copy downscaled to this long side; the crop stays full-res
+DETECT_MAX_SIDE = 480
+MAX_UPLOAD_PIXELS = 40_000_000
+
+def _load_face_cascade():
+    for path in (LBP_CASCADE_PATH, HAAR_CASCADE_PATH):
+        if os.path.exists(path):
+            cascade = cv2.CascadeClassifier(path)
+            if not cascade.empty():
+                return cascade
+    return cv2.CascadeClassifier(HAAR_CASCADE_PATH)
+
+# detectMultiScale keeps per-image scan state on the classifier, so threads must
+# not share one; each thread parses the XML once and reuses its own copy
+_CASCADE_LOCAL = threading.local()
+
+def _get_face_cascade():
+    cascade = getattr(_CASCADE_LOCAL, "cascade", None)
+    if cascade is None:
+        cascade = _CASCADE_LOCAL.cascade = _load_face_cascade()
+    return cascade
 
 # ---------------- helper functions ----------------
 
+_SANITIZE_RE = re.compile(r"[^A-Za-z0-9_]")
+
 def _sanitize_for_filename(s: str):
     if not s:
         return ""
     s = s.strip().replace(" ", "_")
-    s = re.sub(r"[^A-Za-z0-9_]", "", s)
+    s = _SANITIZE_RE.sub("", s)
     return s
 
+def decode_image_b64(b64: str):
+    """Open a base64 (optionally data-URL prefixed) image, decoding JPEGs straight to gray."""
+    if b64.startswith("data:"):
+        b64 = b64.partition(",")[2]
+    # BytesIO shares the decoded bytes' buffer rather than copying it
+    pil = Image.open(io.BytesIO(base64.b64decode(b64)))
+    # let libjpeg decode in grayscale and DCT-downscale large photos, while
+    # keeping enough resolution for face detection (see DETECT_MAX_SIDE)
+    pil.draft("L", (DETECT_MAX_SIDE, DETECT_MAX_SIDE))
+    return pil
+
+def open_upload_image(fp):
+    """Open an uploaded image lazily, refusing absurd dimensions before any pixels are decoded."""
+    pil = Image.open(fp)
+    if pil.width * pil.height > MAX_UPLOAD_PIXELS:
+        raise ValueError(f"Image too large ({pil.width}x{pil.height})")
+    pil.draft("L", (DETECT_MAX_SIDE, DETECT_MAX_SIDE))
+    return pil
+
+def iter_multipart_parts(req, chunk_size=64 * 1024):
+    """Yield (name, filename, BytesIO) for each multipart part as soon as it has fully arrived.
+
+    filename is None for plain form fields. Only one part is held in memory at a time.
+    """
+    boundary = req.mimetype_params.get("boundary", "").encode("latin-1")
+    if req.mimetype != "multipart/form-data" or not boundary:
+        return
+    decoder = MultipartDecoder(boundary, max_form_memory_size=req.max_form_memory_size)
+    part, buf = None, None
+    while True:
+        chunk = req.stream.read(chunk_size)
+        decoder.receive_data(chunk or None)
+        event = decoder.next_event()
+        while not isinstance(event, (NeedData, Epilogue)):
+            if isinstance(event, File):
+                part, buf = (event.name, event.filename), io.BytesIO()
+            elif isinstance(event, Field):
+                part, buf = (event.name, None), io.BytesIO()
+            elif isinstance(event, Data):
+                buf.write(event.data)
+                if not event.more_data:
+                    buf.seek(0)
+                    yield part[0], part[1], buf
+            event = decoder.next_event()
+        if not chunk or isinstance(event, Epilogue):
+            return
+
 def pil_to_gray_np(pil_img: Image.Image):
-    img = pil_img.convert("L")
-    arr = np.array(img)
-    return arr
+    # RGB(A) goes through OpenCV's vectorized luma in a single copy;
+    # palette and other modes still need PIL to interpret them
+    if pil_img.mode == "L":
+        return np.asarray(pil_img)
+    if pil_img.mode == "RGB":
+        return cv2.cvtColor(np.asarray(pil_img), cv2.COLOR_RGB2GRAY)
+    if pil_img.mode == "RGBA":
+        return cv2.cvtColor(np.asarray(pil_img), cv2.COLOR_RGBA2GRAY)
+    return np.asarray(pil_img.convert("L"))
 
 def preprocess_img_np(img_gray, size=(200, 200)):
     if img_gray is None:
         return None
-    img = img_gray.astype(np.uint8)
+    img = img_gray if img_gray.dtype == np.uint8 else img_gray.astype(np.uint8, copy=False)
     img = cv2.equalizeHist(img)
     img = cv2.resize(img, size)
     return img
 
+def equalize_batch_np(batch):
+    """cv2.equalizeHist over an (N, H, W) uint8 stack in one vectorized pass."""
+    n = batch.shape[0]
+    flat = batch.reshape(n, -1)
+    total = flat.shape[1]
+    # per-image bincount on the uint8 rows: no widened N*H*W index copy
+    hist = np.stack([np.bincount(row, minlength=256) for row in flat])
+    cdf = np.cumsum(hist, axis=1)
+    first = np.argmax(hist > 0, axis=1)
+    first_count = hist[np.arange(n), first]
+    # same LUT as OpenCV: the darkest present level maps to 0, the rest scale to 255
+    scale = np.float32(255) / np.maximum(total - first_count, 1).astype(np.float32)
+    lut = np.rint((cdf - first_count[:, None]).astype(np.float32) * scale[:, None])
+    lut = np.clip(lut, 0, 255).astype(np.uint8)
+    flat_imgs = first_count == total
+    lut[flat_imgs] = first[flat_imgs, None]
+    # the uint8 pixels index the LUT directly
+    return np.take_along_axis(lut, flat, axis=1).reshape(batch.shape)
+
+def preprocess_batch_np(imgs, size=(200, 200)):
+    """preprocess_img_np over a list; images already at `size` are equalized as one batch."""
+    out = [None] * len(imgs)
+    batch_idx = [i for i, im in enumerate(imgs) if im is not None and im.dtype == np.uint8 and im.shape == (size[1], size[0])]
+    if batch_idx:
+        eq = equalize_batch_np(np.stack([imgs[i] for i in batch_idx]))
+        for k, i in enumerate(batch_idx):
+            out[i] = eq[k]
+    for i, im in enumerate(imgs):
+        if out[i] is None:
+            out[i] = preprocess_img_np(im, size=size)
+    return out
+
+def detect_largest_face(gray_arr):
+    """Return (x, y, w, h) of the largest face in full-resolution coords, or None."""
+    h, w = gray_arr.shape[:2]
+    scale = DETECT_MAX_SIDE / max(h, w)
+    if scale < 1:
+        small = cv2.resize(gray_arr, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    else:
+        scale = 1.0
+        small = gray_arr
+    # bounding the window size lets the detector skip whole pyramid levels
+    min_size = tuple(max(20, int(v * scale)) for v in FACE_MIN_SIZE)
+    max_side = max(min_size[0], int(min(small.shape[:2]) * 0.9))
+    faces = _get_face_cascade().detectMultiScale(
+        small,
+        scaleFactor=1.2,
+        minNeighbors=5,
+        minSize=min_size,
+        maxSize=(max_side, max_side),
+        flags=cv2.CASCADE_SCALE_IMAGE,
+    )
+    if len(faces) == 0:
+        return None
+    x, y, fw, fh = max(faces, key=lambda r: r[2] * r[3])
+    return (int(x / scale), int(y / scale), int(fw / scale), int(fh / scale))
+
 def preprocess_face_np(gray_arr, size=(200, 200), pad=0.15):
     if gray_arr is None:
         return None
     h, w = gray_arr.shape[:2]
-    face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
-    faces = face_cascade.detectMultiScale(gray_arr, 1.3, 5)
-    if len(faces) == 0:
+    face = detect_largest_face(gray_arr)
+    if face is None:
         return None
-    faces_sorted = sorted(faces, key=lambda r: r[2] * r[3], reverse=True)
-    x, y, fw, fh = faces_sorted[0]
+    x, y, fw, fh = face
     pad_w = int(fw * pad)
     pad_h = int(fh * pad)
     x1 = max(0, x - pad_w)
@@ -104,13 +252,62 @@ def get_db_name_from_conn(conn):
     except Exception:
         return os.getenv("DB_NAME", "face_recognition_db")
 
+# PBKDF2 work factor is calibrated once per process to roughly this much CPU per hash
+PASSWORD_HASH_TARGET_SECONDS = float(os.getenv("PASSWORD_HASH_TARGET_MS", "250")) / 1000
+PBKDF2_MIN_ITERATIONS = 100_000
+_PBKDF2_ITERATIONS = None
+_LEGACY_SHA256_RE = re.compile(r"[0-9a-f]{64}")
+
+def _pbkdf2_iterations() -> int:
+    global _PBKDF2_ITERATIONS
+    if _PBKDF2_ITERATIONS is None:
+        probe = 50_000
+        t0 = time.perf_counter()
+        hashlib.pbkdf2_hmac("sha256", b"calibrate", b"calibrate-salt", probe)
+        elapsed = max(time.perf_counter() - t0, 1e-6)
+        iterations = int(probe * PASSWORD_HASH_TARGET_SECONDS / elapsed) // 10_000 * 10_000
+        _PBKDF2_ITERATIONS = max(PBKDF2_MIN_ITERATIONS, iterations)
+    return _PBKDF2_ITERATIONS
+
 def hash_password(password: str) -> str:
-    return hashlib.sha256(password.encode("utf-8")).hexdigest()
+    return generate_password_hash(password, method=f"pbkdf2:sha256:{_pbkdf2_iterations()}")
+
+def verify_password(password: str, stored: str) -> bool:
+    # accounts created before salted hashing store a bare sha256 hex digest
+    if _LEGACY_SHA256_RE.fullmatch(stored or ""):
+        return hmac.compare_digest(hashlib.sha256(password.encode("utf-8")).hexdigest(), stored)
+    return check_password_hash(stored, password)
+
+def password_needs_rehash(stored: str) -> bool:
+    # calibration jitters between processes, so only upgrade clearly weaker hashes
+    method = (stored or "").split("$", 1)[0].split(":")
+    if len(method) != 3 or method[:2] != ["pbkdf2", "sha256"] or not method[2].isdigit():
+        return True
+    return int(method[2]) < _pbkdf2_iterations() // 2
+
+# (table, index name, column list) added to tables created before the index existed
+SECONDARY_INDEXES = [
+    ("users", "idx_users_face_id", "(face_id)"),
+    ("attendance", "idx_attendance_date", "(date)"),
+    ("attendance", "idx_attendance_ts", "(timestamp DESC)"),
+]
+
+def _ensure_indexes(cur, indexes):
+    # MySQL has no CREATE INDEX IF NOT EXISTS, so look up what is already there
+    cur.execute(
+        "SELECT DISTINCT table_name, index_name FROM information_schema.statistics WHERE table_schema = DATABASE()"
+    )
+    def _s(v):
+        return (v.decode() if isinstance(v, (bytes, bytearray)) else str(v)).lower()
+    existing = {(_s(t), _s(i)) for t, i in cur.fetchall()}
+    for table, name, cols in indexes:
+        if (table.lower(), name.lower()) not in existing:
+            cur.execute(f"CREATE INDEX {name} ON {table} {cols}")
 
 def init_db():
     conn = get_mysql_conn()
     cur = conn.cursor()
-    cur.execute(
+    statements = [
         """
         CREATE TABLE IF NOT EXISTS users (
             id INT AUTO_INCREMENT PRIMARY KEY,
@@ -122,19 +319,16 @@ def init_db():
             uid VARCHAR(100) DEFAULT NULL,
             section VARCHAR(100) DEFAULT NULL,
             course VARCHAR(255) DEFAULT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            INDEX idx_users_face_id (face_id)
         ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
-        """
-    )
-    cur.execute(
+        """,
         """
         CREATE TABLE IF NOT EXISTS faces (
             face_id INT PRIMARY KEY,
             name VARCHAR(255) NOT NULL
         ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
-        """
-    )
-    cur.execute(
+        """,
         """
         CREATE TABLE IF NOT EXISTS attendance (
             id INT AUTO_INCREMENT PRIMARY KEY,
@@ -142,14 +336,40 @@ def init_db():
             name VARCHAR(255),
             timestamp DATETIME,
             date DATE,
-            UNIQUE KEY uniq_face_date (face_id, date)
+            UNIQUE KEY uniq_face_date (face_id, date),
+            INDEX idx_attendance_date (date),
+            INDEX idx_attendance_ts (timestamp DESC)
         ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
-        """
-    )
+        """,
+    ]
+    # send all DDL in one round-trip; the generator must be drained to run them
+    for _ in cur.execute(";".join(statements), multi=True):
+        pass
+    _ensure_indexes(cur, SECONDARY_INDEXES)
     conn.commit()
     cur.close()
     conn.close()
 
+def get_request_conn():
+    """Return one pooled connection shared by every helper in the current request."""
+    if 'db' not in g:
+        g.db = get_mysql_conn()
+    return g.db
+
+@contextlib.contextmanager
+def _db_conn(conn=None):
+    # explicit conn > per-request conn > short-lived conn (scripts, tests, threads)
+    if conn is not None:
+        yield conn
+    elif has_app_context():
+        yield get_request_conn()
+    else:
+        conn = get_mysql_conn()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
 # CRUD wrappers
 
 def create_user(username, password, role, face_id=None, name=None, uid=None, section=None, course=None):
@@ -161,6 +381,7 @@ def create_user(username, password, role, face_id=None, name=None, uid=None, sec
             (username, hash_password(password), role, face_id, name, uid, section, course),
         )
         conn.commit()
+        _user_by_face_id_cached.cache_clear()
         return True, None
     except Exception as e:
         return False, str(e)
@@ -168,6 +389,18 @@ def create_user(username, password, role, face_id=None, name=None, uid=None, sec
         cur.close()
         conn.close()
 
+def _set_password_hash(user_id, password_hash):
+    try:
+        conn = get_mysql_conn()
+        cur = conn.cursor()
+        cur.execute("UPDATE users SET password_hash = %s WHERE id = %s", (password_hash, user_id))
+        conn.commit()
+        cur.close()
+        conn.close()
+    except Exception as e:
+        # login still succeeds; the upgrade is retried next time
+        print("Password hash upgrade failed:", e)
+
 def authenticate(username, password):
     conn = get_mysql_conn()
     cur = conn.cursor(dictionary=True)
@@ -177,20 +410,24 @@ def authenticate(username, password):
     conn.close()
     if not row:
         return False, "User not found"
-    if hash_password(password) != row["password_hash"]:
+    if not verify_password(password, row["password_hash"]):
         return False, "Incorrect password"
+    if password_needs_rehash(row["password_hash"]):
+        _set_password_hash(row["id"], hash_password(password))
+    row["initial"] = row["username"][0].upper()  # avatar letter for the base template
     return True, row
 
-def get_all_users():
-    conn = get_mysql_conn()
-    cur = conn.cursor(dictionary=True)
-    cur.execute("SELECT id, username, role, face_id, name, uid, section, course FROM users ORDER BY id")
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
+def get_all_users(conn=None):
+    with _db_conn(conn) as conn:
+        cur = conn.cursor(dictionary=True)
+        cur.execute("SELECT id, username, role, face_id, name, uid, section, course FROM users ORDER BY id")
+        rows = cur.fetchall()
+        cur.close()
     return rows
 
-def get_user_by_face_id(face_id: int):
+# face_id lookups run per recognition and rarely change; writers below clear it
+@functools.lru_cache(maxsize=4096)
+def _user_by_face_id_cached(face_id: int):
     conn = get_mysql_conn()
     cur = conn.cursor(dictionary=True)
     cur.execute("SELECT * FROM users WHERE face_id = %s LIMIT 1", (face_id,))
@@ -199,6 +436,11 @@ def get_user_by_face_id(face_id: int):
     conn.close()
     return r
 
+def get_user_by_face_id(face_id: int):
+    # hand out a copy so a caller editing the row can't change what later lookups see
+    r = _user_by_face_id_cached(face_id)
+    return dict(r) if r else None
+
 def update_user_face_id(user_id: int, face_id: int):
     conn = get_mysql_conn()
     cur = conn.cursor()
@@ -206,6 +448,7 @@ def update_user_face_id(user_id: int, face_id: int):
     conn.commit()
     cur.close()
     conn.close()
+    _user_by_face_id_cached.cache_clear()
 
 def update_user_details(user_id, name, uid, section, course, role, face_id):
     conn = get_mysql_conn()
@@ -221,63 +464,172 @@ def update_user_details(user_id, name, uid, section, course, role, face_id):
     conn.commit()
     cur.close()
     conn.close()
+    _user_by_face_id_cached.cache_clear()
+    _face_name_cached.cache_clear()
 
 def add_face_mapping(face_id: int, name: str):
     conn = get_mysql_conn()
     cur = conn.cursor()
-    cur.execute("REPLACE INTO faces (face_id, name) VALUES (%s, %s)", (face_id, name))
+    cur.execute(
+        "INSERT INTO faces (face_id, name) VALUES (%s, %s) ON DUPLICATE KEY UPDATE name=VALUES(name)",
+        (face_id, name),
+    )
     conn.commit()
     cur.close()
     conn.close()
+    _face_name_cached.cache_clear()
 
-def get_face_name(face_id: int):
-    conn = get_mysql_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT name FROM faces WHERE face_id = %s", (face_id,))
-    r = cur.fetchone()
-    cur.close()
-    conn.close()
+def _query_face_name(face_id: int, conn=None):
+    with _db_conn(conn) as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT name FROM faces WHERE face_id = %s", (face_id,))
+        r = cur.fetchone()
+        cur.close()
     return r[0] if r else None
 
-def record_attendance(face_id: int, name: str):
+@functools.lru_cache(maxsize=4096)
+def _face_name_cached(face_id: int):
+    return _query_face_name(face_id)
+
+def get_face_name(face_id: int, conn=None):
+    # only lookups on a fresh connection are cached; keying on a passed-in conn would
+    # keep that connection alive in the cache and never hit for the next caller
+    if conn is not None:
+        return _query_face_name(face_id, conn)
+    return _face_name_cached(face_id)
+
+# ---------------- attendance CSV writer ----------------
+
+CSV_FLUSH_ROWS = 100
+CSV_FLUSH_IDLE = 2.0  # seconds without new rows before a partial batch is flushed
+
+_csv_queue = queue.Queue()
+
+def _write_csv_batch(batch):
+    by_date = {}
+    for face_id, name, ts, date_str in batch:
+        by_date.setdefault(date_str, []).append([face_id, name, ts])
+    for date_str, rows in by_date.items():
+        csv_path = os.path.join("attendance", f"{date_str}.csv")
+        os.makedirs(os.path.dirname(csv_path), exist_ok=True)
+        with open(csv_path, "a", newline="", encoding="utf-8") as f:
+            csv.writer(f).writerows(rows)
+
+def _csv_writer_loop():
+    while True:
+        batch = [_csv_queue.get()]
+        while len(batch) < CSV_FLUSH_ROWS:
+            try:
+                batch.append(_csv_queue.get(timeout=CSV_FLUSH_IDLE))
+            except queue.Empty:
+                break
+        try:
+            _write_csv_batch(batch)
+        except Exception as e:
+            print("Attendance CSV write failed:", e)
+        finally:
+            for _ in batch:
+                _csv_queue.task_done()
+
+threading.Thread(target=_csv_writer_loop, name="attendance-csv", daemon=True).start()
+# let the writer drain pending rows before the interpreter exits
+atexit.register(_csv_queue.join)
+
+def record_attendance(face_id: int, name: str, conn=None):
     ensure_directories()
-    conn = get_mysql_conn()
-    cur = conn.cursor()
     ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     date_str = datetime.now().strftime("%Y-%m-%d")
-    cur.execute(
-        """
-        INSERT INTO attendance (face_id, name, timestamp, date)
-        VALUES (%s, %s, %s, %s)
-        ON DUPLICATE KEY UPDATE
-            name=VALUES(name),
-            timestamp=VALUES(timestamp)
-        """,
-        (face_id, name, ts, date_str)
-    )
-    conn.commit()
-    cur.close()
-    conn.close()
-    # optional CSV append
-    csv_path = os.path.join("attendance", f"{date_str}.csv")
-    import csv
-    os.makedirs(os.path.dirname(csv_path), exist_ok=True)
-    with open(csv_path, "a", newline="", encoding="utf-8") as f:
-        writer = csv.writer(f)
-        writer.writerow([face_id, name, ts])
-
-def read_attendance(date_str=None):
-    conn = get_mysql_conn()
-    cur = conn.cursor(dictionary=True)
+    with _db_conn(conn) as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            INSERT INTO attendance (face_id, name, timestamp, date)
+            VALUES (%s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+                name=VALUES(name),
+                timestamp=VALUES(timestamp)
+            """,
+            (face_id, name, ts, date_str)
+        )
+        conn.commit()
+        cur.close()
+    # optional CSV append, written in batches by the background writer
+    _csv_queue.put((face_id, name, ts, date_str))
+
+# (face_id, date) -> monotonic time of the last recorded mark; lets repeated
+# "Mark" clicks skip the DB round-trip the unique key would absorb anyway
+RECENT_MARK_WINDOW = 60.0
+_recent_marks = {}
+_recent_marks_lock = threading.Lock()
+
+def _recently_marked(face_id: int, date_str: str) -> bool:
+    with _recent_marks_lock:
+        t = _recent_marks.get((face_id, date_str))
+    return t is not None and time.monotonic() - t < RECENT_MARK_WINDOW
+
+def _remember_mark(face_id: int, date_str: str):
+    now = time.monotonic()
+    with _recent_marks_lock:
+        # drop expired entries on write so the dict stays at ~active users
+        for key in [k for k, t in _recent_marks.items() if now - t >= RECENT_MARK_WINDOW]:
+            del _recent_marks[key]
+        _recent_marks[(face_id, date_str)] = now
+
+def read_attendance(date_str=None, face_id=None, conn=None):
+    where, args = [], []
     if date_str:
-        cur.execute("SELECT * FROM attendance WHERE date = %s ORDER BY timestamp DESC", (date_str,))
-    else:
-        cur.execute("SELECT * FROM attendance ORDER BY timestamp DESC")
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
+        where.append("date = %s")
+        args.append(date_str)
+    if face_id is not None:
+        # served by the leading column of uniq_face_date (face_id, date)
+        where.append("face_id = %s")
+        args.append(face_id)
+    sql = "SELECT * FROM attendance"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY timestamp DESC"
+    params = tuple(args) or None
+    with _db_conn(conn) as conn:
+        cur = conn.cursor(dictionary=True)
+        cur.execute(sql, params)
+        rows = cur.fetchall()
+        cur.close()
     return rows
 
+def iter_attendance_csv(date_str=None, chunk_rows=500):
+    """Yield attendance rows as CSV text chunks, streaming from an unbuffered cursor."""
+    sql = "SELECT * FROM attendance"
+    params = None
+    if date_str:
+        sql += " WHERE date = %s"
+        params = (date_str,)
+    sql += " ORDER BY timestamp DESC"
+    conn = get_mysql_conn()
+    cur = unbuffered_cursor(conn)
+    try:
+        cur.execute(sql, params)
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(cur.column_names)
+        while True:
+            rows = cur.fetchmany(chunk_rows)
+            if not rows:
+                break
+            writer.writerows(rows)
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+        if buf.tell():
+            yield buf.getvalue()
+    finally:
+        try:
+            # client may disconnect mid-stream; drop unread rows before returning the connection
+            conn.consume_results()
+        except Exception:
+            pass
+        cur.close()
+        conn.close()
+
 def clear_attendance(date_str=None):
     conn = get_mysql_conn()
     cur = conn.cursor()
@@ -288,27 +640,72 @@ def clear_attendance(date_str=None):
     conn.commit()
     cur.close()
     conn.close()
+    with _recent_marks_lock:
+        _recent_marks.clear()
 
 # ---------------- training image helpers ----------------
 
-def save_training_image_for_face(face_id: int, pil_image: Image.Image):
-    arr_gray = pil_image.convert("L")
-    arr = np.array(arr_gray)
-    face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
-    faces = face_cascade.detectMultiScale(arr, 1.3, 5)
-    if len(faces) == 0:
-        face_img = cv2.resize(arr, (200, 200))
-    else:
-        faces_sorted = sorted(faces, key=lambda rect: rect[2] * rect[3], reverse=True)
-        x, y, w, h = faces_sorted[0]
-        face_img = arr[y:y + h, x:x + w]
-        face_img = cv2.resize(face_img, (200, 200))
-    try:
-        face_img = face_img.astype(np.uint8)
-        face_img = cv2.equalizeHist(face_img)
-    except Exception:
-        pass
-    user = get_user_by_face_id(face_id)
+# JPEGs are encoded in the request thread and written to disk in the background
+_IMAGE_WRITER = ThreadPoolExecutor(max_workers=2, thread_name_prefix="image-writer")
+_PENDING_WRITES = {}  # future -> path
+_FAILED_WRITES = {}   # future -> "path: error", kept until a wait_for_image_writes() reports it
+_PENDING_WRITES_LOCK = threading.Lock()
+
+def _write_bytes(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+def _settle_write(fut):
+    # caller holds _PENDING_WRITES_LOCK; a future is settled once, by whichever of
+    # its done-callback and wait_for_image_writes gets here first
+    fname = _PENDING_WRITES.pop(fut, None)
+    if fname is None:
+        return
+    err = None if fut.cancelled() else fut.exception()
+    if err is not None:
+        print("Training image write failed:", fname, err)
+        _FAILED_WRITES[fut] = f"{fname}: {err}"
+
+def _forget_write(fut):
+    with _PENDING_WRITES_LOCK:
+        _settle_write(fut)
+
+def wait_for_image_writes(futures=None):
+    """Block until the given queued writes (default: every pending one) are on disk.
+    Returns "path: error" messages for those that failed; with no argument, every
+    failure not yet reported, so a training run can say which images are missing."""
+    with _PENDING_WRITES_LOCK:
+        pending = list(_PENDING_WRITES) if futures is None else list(futures)
+    if pending:
+        wait(pending)
+    with _PENDING_WRITES_LOCK:
+        for fut in pending:
+            _settle_write(fut)
+        if futures is None:
+            errors = list(_FAILED_WRITES.values())
+            _FAILED_WRITES.clear()
+        else:
+            errors = [_FAILED_WRITES.pop(fut) for fut in pending if fut in _FAILED_WRITES]
+    return errors
+
+# per-face image counters keyed by filename prefix; the folder is scanned once per face
+_FACE_IMG_COUNT = collections.defaultdict(int)
+_FACE_IMG_COUNT_LOCK = threading.Lock()
+
+def _reserve_image_seqs(face_id, count=1):
+    """Reserve count consecutive sequence numbers for face_id's image filenames."""
+    prefix = f"User.{face_id}."
+    with _FACE_IMG_COUNT_LOCK:
+        if prefix not in _FACE_IMG_COUNT:
+            os.makedirs("training_images", exist_ok=True)
+            with os.scandir("training_images") as it:
+                _FACE_IMG_COUNT[prefix] = sum(1 for e in it if e.name.startswith(prefix))
+        first = _FACE_IMG_COUNT[prefix] + 1
+        _FACE_IMG_COUNT[prefix] += count
+        return range(first, first + count)
+
+def _training_image_stem(face_id, user):
+    """Filename stem 'User.<id>[.<name>_<uid>]' shared by all of a face's images."""
     name_uid = ""
     if user:
         name_part = _sanitize_for_filename(user.get("name") or "")
@@ -319,16 +716,69 @@ def save_training_image_for_face(face_id: int, pil_image: Image.Image):
             name_uid = name_part
         elif uid_part:
             name_uid = uid_part
-    os.makedirs("training_images", exist_ok=True)
-    existing = [fn for fn in os.listdir("training_images") if fn.startswith(f"User.{face_id}.")]
-    n = len(existing) + 1
-    if name_uid:
-        fname = os.path.join("training_images", f"User.{face_id}.{name_uid}.{n}.jpg")
+    return f"User.{face_id}.{name_uid}" if name_uid else f"User.{face_id}"
+
+def _prepare_training_face(pil_image):
+    """Crop the largest face (or the whole frame), resize to 200x200 and equalize."""
+    arr = pil_to_gray_np(pil_image)
+    face = detect_largest_face(arr)
+    if face is None:
+        face_img = cv2.resize(arr, (200, 200))
     else:
-        fname = os.path.join("training_images", f"User.{face_id}.{n}.jpg")
-    cv2.imwrite(fname, face_img)
+        x, y, w, h = face
+        face_img = arr[y:y + h, x:x + w]
+        face_img = cv2.resize(face_img, (200, 200))
+    try:
+        face_img = face_img.astype(np.uint8, copy=False)
+        face_img = cv2.equalizeHist(face_img)
+    except Exception:
+        pass
+    return face_img
+
+def _queue_image_write(fname, face_img):
+    ok, buf = cv2.imencode(".jpg", face_img)
+    if not ok:
+        raise ValueError("Failed to encode training image")
+    fut = _IMAGE_WRITER.submit(_write_bytes, fname, buf.tobytes())
+    with _PENDING_WRITES_LOCK:
+        _PENDING_WRITES[fut] = fname
+    fut.add_done_callback(_forget_write)
+    return fut
+
+def save_training_image_for_face(face_id: int, pil_image: Image.Image, user=None, writes=None):
+    """Queue one training image and return its path; the write's future is appended to
+    `writes` when given, for the caller to pass to wait_for_image_writes()."""
+    face_img = _prepare_training_face(pil_image)
+    if user is None:
+        user = get_user_by_face_id(face_id)
+    stem = _training_image_stem(face_id, user)
+    n = _reserve_image_seqs(face_id)[0]
+    fname = os.path.join("training_images", f"{stem}.{n}.jpg")
+    fut = _queue_image_write(fname, face_img)
+    if writes is not None:
+        writes.append(fut)
     return fname
 
+def save_prepared_faces(face_id: int, faces, user=None):
+    """Write faces already run through _prepare_training_face. The user lookup, filename
+    stem and sequence numbers are resolved once for the batch. Returns (saved, errors),
+    counting only images that actually reached disk."""
+    errors = []
+    if not faces:
+        return 0, errors
+    if user is None:
+        user = get_user_by_face_id(face_id)
+    stem = _training_image_stem(face_id, user)
+    writes = []
+    for n, face_img in zip(_reserve_image_seqs(face_id, len(faces)), faces):
+        try:
+            writes.append(_queue_image_write(os.path.join("training_images", f"{stem}.{n}.jpg"), face_img))
+        except Exception as e:
+            errors.append(str(e))
+    failed = wait_for_image_writes(writes)
+    errors.extend(failed)
+    return len(writes) - len(failed), errors
+
 def list_training_images(face_id: int):
     folder = "training_images"
     if not os.path.exists(folder):
@@ -336,6 +786,15 @@ def list_training_images(face_id: int):
     files = sorted([f for f in os.listdir(folder) if f.startswith(f"User.{face_id}.")])
     return [os.path.join(folder, f) for f in files]
 
+def list_all_training_images():
+    """All files in training_images, sorted by name; scandir avoids glob's per-entry stat/fnmatch."""
+    try:
+        with os.scandir("training_images") as it:
+            return sorted((e.path for e in it if e.is_file() and not e.name.startswith(".")),
+                          key=os.path.basename)
+    except FileNotFoundError:
+        return []
+
 def delete_training_image(path: str):
     try:
         os.remove(path)
@@ -343,30 +802,106 @@ def delete_training_image(path: str):
     except Exception as e:
         return False, str(e)
 
+# ---------------- training runs ----------------
+# Only one train_model() runs at a time. Live capture hands training to a
+# background thread; a capture arriving mid-run queues one follow-up run so
+# its images are not missed.
+_TRAIN_LOCK = threading.Lock()
+_train_state_lock = threading.Lock()
+_train_state = {"running": False, "pending": False, "ok": None, "msg": None, "finished_at": None}
+
+def run_training():
+    """Flush queued image writes and train synchronously, serialized with background runs."""
+    with _TRAIN_LOCK:
+        write_errors = wait_for_image_writes()
+        ok, msg = train_model()
+    if write_errors:
+        msg = f"{msg} | {len(write_errors)} training image(s) failed to save and were not used: " + "; ".join(write_errors)
+    return ok, msg
+
+def _background_train_loop():
+    while True:
+        try:
+            ok, msg = run_training()
+        except Exception as e:
+            ok, msg = False, str(e)
+        with _train_state_lock:
+            _train_state.update(ok=ok, msg=msg, finished_at=datetime.now().isoformat(timespec="seconds"))
+            if not _train_state["pending"]:
+                _train_state["running"] = False
+                return
+            _train_state["pending"] = False
+
+def start_background_training():
+    """Start a training run in the background; returns False if one was already running (a rerun is queued)."""
+    with _train_state_lock:
+        if _train_state["running"]:
+            _train_state["pending"] = True
+            return False
+        _train_state["running"] = True
+    threading.Thread(target=_background_train_loop, name="trainer", daemon=True).start()
+    return True
+
+def training_status():
+    with _train_state_lock:
+        return dict(_train_state)
+
 # ---------------- predictor ----------------
 
 class Predictor:
-    def __init__(self, kind, model, proba_threshold=None):
+    def __init__(self, kind, model, proba_threshold=None, transform=None):
         self.kind = kind
         self.model = model
         self.proba_threshold = proba_threshold
+        # sklearn only: feature transform fitted at training time (PCA), applied before the model
+        self.transform = transform
+        # per-thread float32 input row for sklearn, reused across predictions
+        self._local = threading.local()
+
+    def _feature_row(self, face_img):
+        x = getattr(self._local, "x", None)
+        if x is None or x.shape[1] != face_img.size:
+            x = np.empty((1, face_img.size), dtype=np.float32)
+            self._local.x = x
+        x.reshape(face_img.shape)[:] = face_img  # casts uint8 -> float32 in place
+        return x
 
     def predict(self, face_img_200x200_uint8):
         if self.kind == "lbph":
             lbl, conf = self.model.predict(face_img_200x200_uint8)
             return lbl, float(conf), (conf < CONFIDENCE_THRESHOLD)
         else:
-            x = face_img_200x200_uint8.reshape(1, -1).astype("float32")
+            x = self._feature_row(face_img_200x200_uint8)
+            if self.transform is not None:
+                x = self.transform.transform(x)
             if hasattr(self.model, "predict_proba"):
+                # derive the label from the probabilities instead of a second inference pass
                 probs = self.model.predict_proba(x)[0]
-                lbl = int(self.model.predict(x)[0])
-                max_proba = float(np.max(probs))
+                idx = int(np.argmax(probs))
+                lbl = int(self.model.classes_[idx])
+                max_proba = float(probs[idx])
                 return lbl, max_proba, (max_proba >= (self.proba_threshold or 0.80))
             else:
                 lbl = int(self.model.predict(x)[0])
                 return lbl, 0.0, False
 
+_PREDICTOR_CACHE = {"mtime": None, "obj": None, "err": None}
+_PREDICTOR_LOCK = threading.Lock()
+
+def _model_mtimes():
+    return tuple(os.path.getmtime(p) if os.path.exists(p) else None for p in (MODEL_PATH, SKLEARN_MODEL_PATH))
+
 def ensure_predictor():
+    """Return (predictor, err), reloading only when a model file changed on disk."""
+    mtime = _model_mtimes()
+    with _PREDICTOR_LOCK:
+        if _PREDICTOR_CACHE["mtime"] == mtime and (_PREDICTOR_CACHE["obj"] or _PREDICTOR_CACHE["err"]):
+            return _PREDICTOR_CACHE["obj"], _PREDICTOR_CACHE["err"]
+        obj, err = _load_predictor()
+        _PREDICTOR_CACHE.update(mtime=mtime, obj=obj, err=err)
+        return obj, err
+
+def _load_predictor():
     if hasattr(cv2, "face") and os.path.exists(MODEL_PATH):
         try:
             if hasattr(cv2.face, "LBPHFaceRecognizer_create"):
@@ -384,10 +919,12 @@ def ensure_predictor():
             return None, f"Failed to load LBPH model: {e}"
     if os.path.exists(SKLEARN_MODEL_PATH):
         try:
-            with open(SKLEARN_MODEL_PATH, "rb") as f:
-                obj = pickle.load(f)
+            # memory-maps the training matrix when the file was written by joblib.dump
+            obj = joblib.load(SKLEARN_MODEL_PATH, mmap_mode="r")
             knn = obj.get("model", obj)
-            return Predictor("sklearn", knn, proba_threshold=SKLEARN_PROBA_THRESHOLD), None
+            # models saved before PCA features have no 'pca' and take raw pixels
+            return Predictor("sklearn", knn, proba_threshold=SKLEARN_PROBA_THRESHOLD,
+                             transform=obj.get("pca")), None
         except Exception as e:
             return None, f"Failed to load sklearn model: {e}"
     return None, "No trained model found. Ask admin to train (opencv-contrib preferred)."
@@ -397,84 +934,17 @@ def ensure_predictor():
 app = Flask(__name__)
 app.secret_key = os.getenv("FLASK_SECRET_KEY", "replace_this_with_a_real_secret")
 
+@app.teardown_appcontext
+def close_request_conn(_exc):
+    conn = g.pop('db', None)
+    if conn is not None:
+        conn.close()
+
 # Context processor to provide current year to templates
 @app.context_processor
 def inject_current_year():
     return {"current_year": datetime.now().year}
 
-# Inline templates (modernized base + small UI JS hooks)
-BASE = """
-<!doctype html>
-<html lang="en">
-  <head>
-    <meta charset="utf-8">
-    <title>{{ title }}</title>
-    <link rel="stylesheet" href="{{ url_for('static', filename='styles.css') }}">
-    <meta name="viewport" content="width=device-width, initial-scale=1">
-  </head>
-  <body>
-    <div class="app-shell">
-      <aside class="sidebar">
-        <div class="brand">📸 Facial Recognition Attendance System </div>
-        <nav>
-          <a href="/">Dashboard</a>
-          <a href="/attendance/mark_form">Live Attendance</a>
-          <a href="/attendance/history">My History</a>
-          {% if session.get('user') and session.user.role == 'admin' %}
-            <a href="/admin">Admin</a>
-          {% endif %}
-        </nav>
-      </aside>
-
-      <div class="main">
-        <header class="topbar">
-          <h1>{{ title }}</h1>
-          <div class="topbar-right">
-            <button class="theme-toggle" title="Toggle theme">🌙</button>
-
-            {% if session.get('user') %}
-            <div class="user-menu">
-              <div class="user-avatar" id="user-avatar">{{ session.user.username[0]|upper }}</div>
-              <div class="dropdown" id="user-dropdown">
-                <a href="/profile">👤 Profile</a>
-                <a href="/logout">🚪 Logout</a>
-              </div>
-            </div>
-            {% else %}
-              <a href="/login" class="btn small">Login</a>
-              <a href="/signup" class="btn small">Signup</a>
-            {% endif %}
-          </div>
-        </header>
-
-        <main class="content">
-          {% with messages = get_flashed_messages() %}
-            {% if messages %}
-              <div id="toasts" class="toasts">
-                {% for m in messages %}
-                  <div class="toast">{{ m }}</div>
-                {% endfor %}
-              </div>
-            {% endif %}
-          {% endwith %}
-          {% block body %}{% endblock %}
-        </main>
-
-        <footer class="app-footer">&copy; {{ current_year }} Face Attendance</footer>
-      </div>
-    </div>
-
-    <script src="{{ url_for('static', filename='app.js') }}"></script>
-  </body>
-</html>
-"""
-
-# Register in-memory "base" so {% extends "base" %} works
-app.jinja_loader = ChoiceLoader([
-    DictLoader({"base": BASE}),
-    app.jinja_loader,  # keep filesystem loader if you add files later
-])
-
 # ensure DB ready
 try:
     ok_conn, msg_conn = test_connection()
@@ -487,7 +957,7 @@ init_db()
 
 # --------- routes ---------
 
-# Simple Dashboard (HOME template)
+# Inline templates (modernized base + small UI JS hooks)
 BASE = """
 <!doctype html>
 <html lang="en">
@@ -518,7 +988,7 @@ BASE = """
             <button class="theme-toggle" title="Toggle theme">🌗</button>
             {% if session.get('user') %}
               <div class="user-menu">
-                <div class="user-avatar" id="user-avatar">{{ session.user.username[0]|upper }}</div>
+                <div class="user-avatar" id="user-avatar">{{ session.user.initial or session.user.username[0]|upper }}</div>
                 <div class="dropdown" id="user-dropdown">
                   <a href="/profile">👤 Profile</a>
                   <a href="/logout">🚪 Logout</a>
@@ -550,11 +1020,30 @@ BASE = """
 </html>
 """
 
+# Register in-memory "base" so {% extends "base" %} works
 app.jinja_loader = ChoiceLoader([
     DictLoader({"base": BASE}),
-    app.jinja_loader
+    app.jinja_loader,  # keep filesystem loader if you add files later
 ])
 
+def compile_template(source):
+    """Dedent and compile an inline template once at import so views only pay for .render()."""
+    return app.jinja_env.from_string(textwrap.dedent(source))
+
+def _make_renderer(source, **static_ctx):
+    """Compile source once and bind its static context (e.g. title) into a per-view renderer.
+
+    Every page extends 'base', which reads session, flashes and the current
+    year, so output can't be frozen at import; only the per-call work is cut.
+    """
+    tpl = compile_template(source)
+    def _renderer(**ctx):
+        context = dict(static_ctx, **ctx)
+        # same context render_template_string provides (request, session, g, ...)
+        app.update_template_context(context)
+        return tpl.render(context)
+    return _renderer
+
 # ============================================================
 # Routes
 # ============================================================
@@ -579,14 +1068,13 @@ HOME = """
 </div>
 {% endblock %}
 """
+render_home = _make_renderer(HOME, title="Dashboard")
 
 @app.route('/')
 def index():
-    return render_template_string(HOME, title="Dashboard")
+    return render_home()
 
-@app.route('/signup', methods=['GET', 'POST'])
-def signup():
-    T = """
+SIGNUP = """
     {% extends 'base' %}
     {% block body %}
     <div class="card">
@@ -603,7 +1091,11 @@ def signup():
       </form>
     </div>
     {% endblock %}
-    """
+"""
+render_signup = _make_renderer(SIGNUP, title="Signup")
+
+@app.route('/signup', methods=['GET', 'POST'])
+def signup():
     if request.method == 'POST':
         ok, err = create_user(
             request.form['username'],
@@ -617,11 +1109,9 @@ def signup():
         )
         flash('✅ Account created. Please login.' if ok else f'❌ Signup failed: {err}')
         return redirect(url_for('login' if ok else 'signup'))
-    return render_template_string(T, title="Signup")
+    return render_signup()
 
-@app.route('/login', methods=['GET', 'POST'])
-def login():
-    T = """
+LOGIN = """
     {% extends 'base' %}
     {% block body %}
     <div class="card">
@@ -633,7 +1123,11 @@ def login():
       </form>
     </div>
     {% endblock %}
-    """
+"""
+render_login = _make_renderer(LOGIN, title="Login")
+
+@app.route('/login', methods=['GET', 'POST'])
+def login():
     if request.method == 'POST':
         ok, res = authenticate(request.form['username'], request.form['password'])
         if not ok:
@@ -642,7 +1136,7 @@ def login():
         session['user'] = res
         flash(f"✅ Logged in as {res['username']}")
         return redirect(url_for('index'))
-    return render_template_string(T, title="Login")
+    return render_login()
 
 @app.route('/logout')
 def logout():
@@ -652,13 +1146,14 @@ def logout():
 
 # ----- admin -----
 
-@app.route('/admin')
-def admin_dashboard():
-    if not session.get('user') or session['user']['role'] != 'admin':
-        flash('Admin only')
-        return redirect(url_for('index'))
-    users = get_all_users()
-    T = """
+def _user_for_face_id(face_id):
+    """Return the user row for face_id, reusing the logged-in user's session copy when it matches."""
+    su = session.get('user')
+    if su and su.get('face_id') is not None and su.get('face_id') == face_id:
+        return su
+    return get_user_by_face_id(face_id)
+
+ADMIN_DASHBOARD = """
     {% extends 'base' %}
     {% block body %}
     <div class="card">
@@ -681,8 +1176,16 @@ def admin_dashboard():
       </div>
     </div>
     {% endblock %}
-    """
-    return render_template_string(T, title="Admin Dashboard", users=users)
+"""
+render_admin_dashboard = _make_renderer(ADMIN_DASHBOARD, title="Admin Dashboard")
+
+@app.route('/admin')
+def admin_dashboard():
+    if not session.get('user') or session['user']['role'] != 'admin':
+        flash('Admin only')
+        return redirect(url_for('index'))
+    users = get_all_users()
+    return render_admin_dashboard(users=users)
 
 @app.route('/admin/clear_attendance', methods=['POST'])
 def admin_clear_attendance():
@@ -707,19 +1210,14 @@ def admin_train():
     if not session.get('user') or session['user']['role'] != 'admin':
         flash('Admin only')
         return redirect(url_for('index'))
-    ok, msg = train_model()
+    ok, msg = run_training()
     if ok:
         flash(msg)
     else:
         flash('Training failed: ' + (msg or ''))
     return redirect(url_for('admin_dashboard'))
 
-@app.route('/admin/upload', methods=['GET','POST'])
-def admin_upload():
-    if not session.get('user') or session['user']['role'] != 'admin':
-        flash('Admin only')
-        return redirect(url_for('index'))
-    T = """
+ADMIN_UPLOAD = """
     {% extends 'base' %}
     {% block body %}
     <div class="card">
@@ -731,36 +1229,59 @@ def admin_upload():
       </form>
     </div>
     {% endblock %}
-    """
+"""
+render_admin_upload = _make_renderer(ADMIN_UPLOAD, title='Bulk upload')
+
+@app.route('/admin/upload', methods=['GET','POST'])
+def admin_upload():
+    if not session.get('user') or session['user']['role'] != 'admin':
+        flash('Admin only')
+        return redirect(url_for('index'))
     if request.method == 'POST':
-        face_id = request.form.get('face_id')
-        try:
-            face_id = int(face_id)
-        except Exception:
-            flash('Invalid face id')
-            return redirect(url_for('admin_upload'))
-        files = request.files.getlist('files')
+        # parts are handled as they arrive instead of buffering every file first;
+        # the form puts face_id before the files, anything earlier waits for it
+        face_id = None
+        user = None
+        pending = []
         saved = 0
         errors = []
-        for f in files:
-            try:
-                pil = Image.open(f.stream)
-                save_training_image_for_face(face_id, pil)
-                saved += 1
-            except Exception as e:
-                errors.append(str(e))
+        writes = []
+        for name, filename, buf in iter_multipart_parts(request):
+            if filename is None:
+                if name == 'face_id':
+                    try:
+                        face_id = int(buf.getvalue().decode('utf-8'))
+                    except Exception:
+                        flash('Invalid face id')
+                        return redirect(url_for('admin_upload'))
+                    user = _user_for_face_id(face_id)
+                continue
+            if name != 'files':
+                continue
+            pending.append(buf)
+            if face_id is None:
+                continue
+            for b in pending:
+                try:
+                    save_training_image_for_face(face_id, open_upload_image(b), user=user, writes=writes)
+                    saved += 1
+                except Exception as e:
+                    errors.append(str(e))
+            pending = []
+        if face_id is None:
+            flash('Invalid face id')
+            return redirect(url_for('admin_upload'))
+        # writes overlap with parsing the rest of the upload; only count what reached disk
+        failed = wait_for_image_writes(writes)
+        saved -= len(failed)
+        errors.extend(failed)
         flash(f'Saved {saved} files')
         if errors:
             flash('Errors: ' + '; '.join(errors))
         return redirect(url_for('admin_dashboard'))
-    return render_template_string(T, title='Bulk upload')
+    return render_admin_upload()
 
-@app.route('/admin/live_capture')
-def admin_live_capture():
-    if not session.get('user') or session['user']['role'] != 'admin':
-        flash('Admin only')
-        return redirect(url_for('index'))
-    T = """
+LIVE_CAPTURE = """
     {% extends 'base' %}
     {% block body %}
     <div class="card">
@@ -776,37 +1297,63 @@ def admin_live_capture():
       <div style="margin-top:8px;"><button id="startCapture" class="btn btn-primary">Start capture</button></div>
     </div>
     {% endblock %}
-    """
-    return render_template_string(T, title='Live capture & train')
+"""
+render_live_capture = _make_renderer(LIVE_CAPTURE, title='Live capture & train')
+
+@app.route('/admin/live_capture')
+def admin_live_capture():
+    if not session.get('user') or session['user']['role'] != 'admin':
+        flash('Admin only')
+        return redirect(url_for('index'))
+    return render_live_capture()
+
+# long-lived workers so each keeps its parsed per-thread cascade across requests
+_CAPTURE_POOL = ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 4), thread_name_prefix="capture")
 
 @app.route('/admin/live_capture_upload', methods=['POST'])
 def admin_live_capture_upload():
     if not session.get('user') or session['user']['role'] != 'admin':
         return jsonify({'ok':False,'message':'Admin only'}), 403
-    data = request.get_json()
-    face_id = data.get('face_id')
+    data = request.get_json(silent=True) or {}
+    # validated before it reaches the cached lookup, which would otherwise keep
+    # one entry per arbitrary value a client sends
+    try:
+        face_id = int(data.get('face_id'))
+    except (TypeError, ValueError):
+        return jsonify({'ok':False,'message':'Invalid face id'}), 400
     images = data.get('images') or []
-    saved = 0
-    errors = []
-    for idx, b64 in enumerate(images):
+    user = _user_for_face_id(face_id)
+
+    def _prepare_one(b64):
+        # base64/JPEG decode, cascade and resize mostly release the GIL, so frames overlap;
+        # detection uses this worker thread's own cascade (see _get_face_cascade)
         try:
-            img_bytes = base64.b64decode(b64)
-            pil = Image.open(io.BytesIO(img_bytes)).convert('L')
-            save_training_image_for_face(face_id, pil)
-            saved += 1
+            return _prepare_training_face(decode_image_b64(b64).convert('L')), None
         except Exception as e:
-            errors.append(str(e))
-    ok, msg = train_model()  # auto-train after capture
-    return jsonify({'ok':True,'saved':saved,'errors':errors,'train_ok':ok,'train_msg':msg})
+            return None, str(e)
 
-@app.route('/admin/gallery')
-def admin_gallery():
+    faces = []
+    errors = []
+    for face_img, err in _CAPTURE_POOL.map(_prepare_one, images):
+        if err is None:
+            faces.append(face_img)
+        else:
+            errors.append(err)
+    saved, save_errors = save_prepared_faces(face_id, faces, user=user)
+    errors.extend(save_errors)
+    # auto-train after capture, without holding the request open for the whole run
+    # if a run is already going, a rerun is queued behind it instead
+    started = start_background_training()
+    return jsonify({'ok':True,'saved':saved,'errors':errors,'train_started':started,'train_queued':not started})
+
+@app.route('/admin/train_status')
+def admin_train_status():
     if not session.get('user') or session['user']['role'] != 'admin':
-        flash('Admin only')
-        return redirect(url_for('index'))
-    face_id = request.args.get('face_id', type=int)
-    files = list_training_images(face_id) if face_id else []
-    T = """
+        return jsonify({'ok':False,'message':'Admin only'}), 403
+    st = training_status()
+    return jsonify({'ok':True,'running':st['running'],'train_ok':st['ok'],'train_msg':st['msg'],'finished_at':st['finished_at']})
+
+GALLERY = """
     {% extends 'base' %}
     {% block body %}
     <div class="card">
@@ -821,8 +1368,17 @@ def admin_gallery():
       {% endif %}
     </div>
     {% endblock %}
-    """
-    return render_template_string(T, title='Gallery', face_id=face_id, files=files)
+"""
+render_gallery = _make_renderer(GALLERY, title='Gallery')
+
+@app.route('/admin/gallery')
+def admin_gallery():
+    if not session.get('user') or session['user']['role'] != 'admin':
+        flash('Admin only')
+        return redirect(url_for('index'))
+    face_id = request.args.get('face_id', type=int)
+    files = list_training_images(face_id) if face_id else []
+    return render_gallery(face_id=face_id, files=files)
 
 @app.route('/admin/delete_image')
 def admin_delete_image():
@@ -840,6 +1396,9 @@ def admin_delete_image():
         flash('Delete failed: ' + (err or ''))
     return redirect(url_for('admin_gallery') + f"?face_id={request.args.get('face_id','')}")
 
+# training images evaluated per batch in /admin/evaluate
+EVAL_CHUNK = 256
+
 @app.route('/admin/evaluate')
 def admin_evaluate():
     if not session.get('user') or session['user']['role'] != 'admin':
@@ -852,31 +1411,33 @@ def admin_evaluate():
     if rec.kind != 'lbph':
         flash('Evaluator reports LBPH confidences only. Use LBPH model to evaluate.')
         return redirect(url_for('admin_dashboard'))
-    files = sorted(glob.glob('training_images/*'))
-    confs = []
-    for f in files:
-        img = cv2.imread(f, cv2.IMREAD_GRAYSCALE)
-        if img is None:
-            continue
-        proc = preprocess_img_np(img)
-        if proc is None:
-            continue
+    files = list_all_training_images()
+
+    def _conf(proc):
         try:
-            _, conf = rec.model.predict(proc)
-            confs.append(conf)
+            return rec.model.predict(proc)[1]
         except Exception:
-            continue
+            return None
+
+    # cv2.imread and LBPH predict release the GIL, so both overlap across threads;
+    # images are loaded and equalized EVAL_CHUNK at a time to bound memory
+    confs = []
+    with ThreadPoolExecutor(max_workers=os.cpu_count() or 4) as ex:
+        for start in range(0, len(files), EVAL_CHUNK):
+            chunk = files[start:start + EVAL_CHUNK]
+            imgs = [img for img in ex.map(read_gray_image, chunk) if img is not None]
+            procs = [p for p in preprocess_batch_np(imgs) if p is not None]
+            confs.extend(c for c in ex.map(_conf, procs) if c is not None)
     if confs:
-        flash(f'Training image confidences: count={len(confs)}, min={min(confs):.2f}, median={statistics.median(confs):.2f}, max={max(confs):.2f}')
+        arr = np.asarray(confs, dtype=np.float64)
+        flash(f'Training image confidences: count={arr.size}, min={arr.min():.2f}, median={np.median(arr):.2f}, max={arr.max():.2f}')
     else:
         flash('No valid predictions')
     return redirect(url_for('admin_dashboard'))
 
 # ----- attendance (live camera) -----
 
-@app.route('/attendance/mark_form')
-def mark_form():
-    T = """
+MARK_FORM = """
     {% extends 'base' %}
     {% block body %}
     <div class="card">
@@ -897,8 +1458,12 @@ def mark_form():
       </form>
     </div>
     {% endblock %}
-    """
-    return render_template_string(T, title='Mark attendance')
+"""
+render_mark_form = _make_renderer(MARK_FORM, title='Mark attendance')
+
+@app.route('/attendance/mark_form')
+def mark_form():
+    return render_mark_form()
 
 @app.route('/attendance/mark', methods=['POST'])
 def mark_attendance():
@@ -911,8 +1476,7 @@ def mark_attendance():
         if not b64:
             return jsonify({'ok':False,'message':'No image provided'}), 400
         try:
-            img_bytes = base64.b64decode(b64)
-            pil = Image.open(io.BytesIO(img_bytes))
+            pil = decode_image_b64(b64)
         except Exception as e:
             return jsonify({'ok':False,'message':'Invalid image: '+str(e)}), 400
     else:
@@ -920,7 +1484,7 @@ def mark_attendance():
         if not f:
             return redirect(url_for('mark_form'))
         try:
-            pil = Image.open(f.stream)
+            pil = open_upload_image(f.stream)
         except Exception:
             flash('Invalid image')
             return redirect(url_for('mark_form'))
@@ -952,7 +1516,10 @@ def mark_attendance():
             return jsonify({'ok':False,'message':f'Recognized as id {label}, which does not match your assigned id {user_face_id}','info':info}) if request.is_json \
                 else (flash(f'Recognized as id {label}, which does not match your assigned id {user_face_id}') or redirect(url_for('mark_form')))
         name = get_face_name(label) or f'User{label}'
-        record_attendance(label, name)
+        today = datetime.now().strftime("%Y-%m-%d")
+        if not _recently_marked(label, today):
+            record_attendance(label, name)
+            _remember_mark(label, today)
         msg = f'Recognized as {name} — attendance recorded'
         return jsonify({'ok':True,'message':msg,'info':info}) if request.is_json \
             else (flash(msg) or redirect(url_for('index')))
@@ -960,16 +1527,7 @@ def mark_attendance():
         return jsonify({'ok':False,'message':'Recognition error: '+str(e)}) if request.is_json \
             else (flash('Recognition error: '+str(e)) or redirect(url_for('mark_form')))
 
-@app.route('/attendance/history')
-def attendance_history():
-    if not session.get('user'):
-        flash('Login required')
-        return redirect(url_for('login'))
-    rows = read_attendance()
-    user_face = session['user'].get('face_id')
-    if user_face:
-        rows = [r for r in rows if r['face_id'] == user_face]
-    T = """
+HISTORY = """
     {% extends 'base' %}
     {% block body %}
     <div class="card">
@@ -988,8 +1546,17 @@ def attendance_history():
       {% endif %}
     </div>
     {% endblock %}
-    """
-    return render_template_string(T, title='My attendance', rows=rows)
+"""
+render_history = _make_renderer(HISTORY, title='My attendance')
+
+@app.route('/attendance/history')
+def attendance_history():
+    if not session.get('user'):
+        flash('Login required')
+        return redirect(url_for('login'))
+    user_face = session['user'].get('face_id')
+    rows = read_attendance(face_id=user_face or None)
+    return render_history(rows=rows)
 
 @app.route('/attendance/records')
 def attendance_records():
@@ -997,10 +1564,19 @@ def attendance_records():
         flash('Admin only')
         return redirect(url_for('index'))
     d = request.args.get('date')
-    rows = read_attendance(date_str=d)
-    df = pd.DataFrame(rows)
-    csv_bytes = df.to_csv(index=False).encode('utf-8')
-    return send_file(io.BytesIO(csv_bytes), mimetype='text/csv', as_attachment=True, download_name=f"attendance_{d or 'all'}.csv")
+    if d:
+        try:
+            datetime.strptime(d, "%Y-%m-%d")
+        except ValueError:
+            flash('Invalid date')
+            return redirect(url_for('admin_dashboard'))
+    resp = Response(
+        stream_with_context(iter_attendance_csv(date_str=d)),
+        mimetype='text/csv',
+    )
+    # werkzeug quotes the filename instead of it being pasted into the header
+    resp.headers.set('Content-Disposition', 'attachment', filename=f"attendance_{d or 'all'}.csv")
+    return resp
 
 # -------------- run --------------
 if __name__ == '__main__':
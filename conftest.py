@@ -0,0 +1,65 @@
+# ============================================================
+# conftest.py
+# Shared fixtures: one app / DB setup per pytest session
+# ============================================================
+
+import io
+import os
+import pytest
+from PIL import Image
+
+# app is imported inside the fixtures: importing it connects to MySQL, and test_db.py
+# must still collect and report DB failures when the server is down
+
+
+@pytest.fixture(scope="session")
+def _app():
+    """Flask app with the schema created once for the whole run."""
+    from app import app, init_db
+    init_db()
+    app.config["TESTING"] = True
+    app.secret_key = "test_secret"
+    return app
+
+
+@pytest.fixture(scope="session")
+def client(_app):
+    """Flask test client shared by every test module."""
+    with _app.test_client() as client:
+        yield client
+
+
+def _encode_min_jpeg():
+    # routes really decode uploads, so this must be a valid image; 1x1 keeps the
+    # encode trivial and the app resizes it to 200x200 like any other frame
+    buf = io.BytesIO()
+    Image.new("L", (1, 1), 255).save(buf, format="JPEG")
+    return buf.getvalue()
+
+
+_MIN_JPEG = _encode_min_jpeg()
+
+
+@pytest.fixture(scope="session")
+def jpeg_bytes():
+    """A tiny valid JPEG; tests only check status codes / JSON."""
+    return _MIN_JPEG
+
+
+@pytest.fixture(scope="session")
+def trained_model(_app):
+    """Model paths on disk, training at most once per session (skipped when the
+    models are already newer than every training image, e.g. after test_admin_train_model)."""
+    from app import (run_training, wait_for_image_writes, list_all_training_images,
+                     MODEL_PATH, SKLEARN_MODEL_PATH)
+    wait_for_image_writes()
+    models = [p for p in (MODEL_PATH, SKLEARN_MODEL_PATH) if os.path.exists(p)]
+    images = list_all_training_images()
+    if not images and not models:
+        pytest.skip("no training images to train on")
+    newest_image = max((os.path.getmtime(p) for p in images), default=0)
+    if not models or min(os.path.getmtime(p) for p in models) < newest_image:
+        ok, msg = run_training()
+        assert ok, msg
+        models = [p for p in (MODEL_PATH, SKLEARN_MODEL_PATH) if os.path.exists(p)]
+    return models
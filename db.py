@@ -3,7 +3,7 @@ MySQL connector for Face Recognition Attendance System.
 
 This module:
  - Creates a small MySQL connection pool (if possible)
- - Wraps connection.cursor so returned cursors are buffered by default
+ - Configures connections so cursor() returns buffered cursors by default
  - Provides get_conn() and test_connection()
 """
 
@@ -11,7 +11,6 @@ import os
 import mysql.connector
 from mysql.connector import pooling
 from mysql.connector import Error as MySQLError
-from functools import wraps
 
 # ---------------- CONFIG ----------------
 DB_CONFIG = {
@@ -22,6 +21,8 @@ DB_CONFIG = {
     "database": os.getenv("DB_NAME", "face_recognition_db"),
     # autocommit left False so callers explicitly commit when needed
     "autocommit": False,
+    # cursor() is buffered unless asked otherwise (avoids 'Unread result found')
+    "buffered": True,
 }
 
 _POOL = None
@@ -33,7 +34,7 @@ def _init_pool():
     try:
         _POOL = pooling.MySQLConnectionPool(
             pool_name="face_attendance_pool",
-            pool_size=int(os.getenv("DB_POOL_SIZE", "5")),
+            pool_size=int(os.getenv("DB_POOL_SIZE", "10")),
             **DB_CONFIG,
         )
         print("[db.py] ✅ MySQL connection pool initialized.")
@@ -46,41 +47,9 @@ def _init_pool():
 _init_pool()
 
 
-def _wrap_conn_with_buffered_cursor(conn):
-    """
-    Monkeypatch conn.cursor so that:
-      - cursor() by default returns buffered cursors (avoids 'Unread result found')
-      - supports cursor(dictionary=True) and other kwargs as usual
-    Avoids double-wrapping by setting an attribute flag on the connection.
-    """
-    if getattr(conn, "_cursor_wrapped_by_dbpy", False):
-        return conn
-
-    orig_cursor = conn.cursor
-
-    @wraps(orig_cursor)
-    def cursor_wrapper(*args, **kwargs):
-        # If code passed buffered explicitly, respect it; otherwise default to True.
-        if "buffered" not in kwargs:
-            kwargs["buffered"] = True
-        return orig_cursor(*args, **kwargs)
-
-    # Replace the cursor attribute only on this connection instance
-    try:
-        conn.cursor = cursor_wrapper
-        conn._cursor_wrapped_by_dbpy = True
-    except Exception:
-        # if the connection object is implemented in C or is immutable,
-        # fall back to returning the original connection unchanged.
-        pass
-
-    return conn
-
-
 def _direct_connect():
-    """Create a direct MySQL connection and wrap it for buffered cursors."""
-    conn = mysql.connector.connect(**DB_CONFIG)
-    return _wrap_conn_with_buffered_cursor(conn)
+    """Create a direct MySQL connection (buffered cursors by default)."""
+    return mysql.connector.connect(**DB_CONFIG)
 
 
 def get_conn():
@@ -92,14 +61,29 @@ def get_conn():
     global _POOL
     if _POOL:
         try:
-            conn = _POOL.get_connection()
-            return _wrap_conn_with_buffered_cursor(conn)
+            return _POOL.get_connection()
         except Exception as e:
             # Pool failed -> fallback to direct connect
             print(f"[db.py] ⚠️ Pool get_connection() failed, using direct connect: {e}")
     return _direct_connect()
 
 
+def unbuffered_cursor(conn):
+    """Return a streaming cursor on conn despite the buffered default.
+
+    The C extension ignores cursor(buffered=False) once the connection is
+    buffered, so ask for its plain cursor class explicitly.
+    """
+    try:
+        from mysql.connector.connection_cext import CMySQLConnection
+        from mysql.connector.cursor_cext import CMySQLCursor
+    except ImportError:
+        CMySQLConnection = None
+    if CMySQLConnection is not None and isinstance(getattr(conn, "_cnx", conn), CMySQLConnection):
+        return conn.cursor(cursor_class=CMySQLCursor)
+    return conn.cursor(buffered=False)
+
+
 def test_connection():
     """Simple connection test. Returns (ok: bool, message: str)."""
     try:
@@ -1,11 +1,9 @@
 # eval_on_train.py
 import os
-import glob
 import cv2
 import numpy as np
-from collections import defaultdict
-import statistics
-from trainer import preprocess_img, IMAGE_SIZE
+from concurrent.futures import ThreadPoolExecutor
+from trainer import preprocess_img, read_gray_image, parse_face_id, IMAGE_SIZE
 
 MODEL_PATH = "models/trained_model.yml"
 
@@ -34,14 +32,23 @@ def load_recognizer(model_path):
     return rec
 
 def parse_expected_label(fname):
-    stem = os.path.splitext(os.path.basename(fname))[0]
-    parts = stem.split('.')
-    if len(parts) >= 2 and parts[1].isdigit():
-        return int(parts[1])
-    return None
+    # same file-name rule the trainer labels its samples with
+    return parse_face_id(fname)
+
+def _load_and_preprocess(f):
+    # cv2 releases the GIL in imread/equalizeHist/resize, so this runs in parallel threads
+    img = read_gray_image(f)
+    if img is None:
+        return img, None
+    return img, preprocess_img(img, size=IMAGE_SIZE)
 
 def main():
-    files = sorted(glob.glob(os.path.join('training_images', '*')))
+    try:
+        with os.scandir('training_images') as it:
+            files = sorted((e.path for e in it if e.is_file() and not e.name.startswith('.')),
+                           key=os.path.basename)
+    except FileNotFoundError:
+        files = []
     if not files:
         print('No training_images found.')
         return
@@ -52,51 +59,65 @@ def main():
         print('Failed to load recognizer:', e)
         return
 
-    per_id = defaultdict(list)
+    expected_ids = []
     all_confs = []
     mismatches = []
 
-    for f in files:
-        expected = parse_expected_label(f)
-        img = cv2.imread(f, cv2.IMREAD_GRAYSCALE)
-        if img is None:
-            print(f"Failed to read {f}")
-            continue
-        proc = preprocess_img(img, size=IMAGE_SIZE)
-        if proc is None:
-            print(f"Preprocessing returned None for {f}")
-            continue
-        try:
-            lbl, conf = rec.predict(proc)
-        except Exception as e:
-            print(f"Predict failed for {f}: {e}")
-            continue
-        all_confs.append(conf)
-        if expected is not None:
-            per_id[expected].append(conf)
-        ok = (expected == lbl)
-        print(f"{os.path.basename(f)} -> predicted={lbl}, conf={conf:.2f}, expected={expected}, ok={ok}")
-        if not ok:
-            mismatches.append((f, expected, lbl, conf))
+    expected_labels = [parse_expected_label(f) for f in files]
+
+    with ThreadPoolExecutor(max_workers=os.cpu_count() or 4) as ex:
+        loaded = ex.map(_load_and_preprocess, files)
+        for f, expected, (img, proc) in zip(files, expected_labels, loaded):
+            if img is None:
+                print(f"Failed to read {f}")
+                continue
+            if proc is None:
+                print(f"Preprocessing returned None for {f}")
+                continue
+            try:
+                lbl, conf = rec.predict(proc)
+            except Exception as e:
+                print(f"Predict failed for {f}: {e}")
+                continue
+            all_confs.append(conf)
+            expected_ids.append(-1 if expected is None else expected)
+            ok = (expected == lbl)
+            print(f"{os.path.basename(f)} -> predicted={lbl}, conf={conf:.2f}, expected={expected}, ok={ok}")
+            if not ok:
+                mismatches.append((f, expected, lbl, conf))
 
     if not all_confs:
         print('No predictions made.')
         return
 
+    confs = np.asarray(all_confs, dtype=np.float64)
+    rec_median = float(np.median(confs))
     print('\nSummary statistics:')
-    print(f"Total training images evaluated: {len(all_confs)}")
-    print(f"Global confs — min:{min(all_confs):.2f}, median:{statistics.median(all_confs):.2f}, mean:{statistics.mean(all_confs):.2f}, max:{max(all_confs):.2f}")
+    print(f"Total training images evaluated: {len(confs)}")
+    print(f"Global confs — min:{confs.min():.2f}, median:{rec_median:.2f}, mean:{confs.mean():.2f}, max:{confs.max():.2f}")
 
     print('\nPer-face-id medians:')
+    labels = np.asarray(expected_ids, dtype=np.int32)
+    known = labels >= 0
+    labels, confs_known = labels[known], confs[known]
+    # sort by face id so each id is one contiguous run, then reduce per run
+    order = np.argsort(labels, kind="stable")
+    labels, confs_known = labels[order], confs_known[order]
     medians = []
-    for fid in sorted(per_id.keys()):
-        vals = per_id[fid]
-        print(f"face_id={fid}: count={len(vals)}, min={min(vals):.2f}, median={statistics.median(vals):.2f}, mean={statistics.mean(vals):.2f}, max={max(vals):.2f}")
-        medians.append(statistics.median(vals))
+    if labels.size:
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(labels)) + 1))
+        ids = labels[starts]
+        counts = np.diff(np.append(starts, labels.size))
+        mins = np.minimum.reduceat(confs_known, starts)
+        maxs = np.maximum.reduceat(confs_known, starts)
+        means = np.add.reduceat(confs_known, starts) / counts
+        for k, (fid, run) in enumerate(zip(ids, np.split(confs_known, starts[1:]))):
+            med = float(np.median(run))
+            print(f"face_id={fid}: count={counts[k]}, min={mins[k]:.2f}, median={med:.2f}, mean={means[k]:.2f}, max={maxs[k]:.2f}")
+            medians.append(med)
 
     if medians:
-        global_median = statistics.median(medians)
-        rec_median = statistics.median(all_confs)
+        global_median = float(np.median(medians))
         # Heuristic recommendation: choose threshold somewhat above median of training confs
         recommended = max(rec_median * 1.5, rec_median + 20)
         print('\nRecommended starting CONFIDENCE_THRESHOLD (LBPH, lower is better):')
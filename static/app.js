@@ -198,11 +198,11 @@ document.addEventListener("DOMContentLoaded", () => {
 
         const data = await res.json();
         if (data.ok) {
-          alert(
-            `✅ ${data.saved} images saved.\nTraining: ${
-              data.train_ok ? "✅ Done" : "❌ Failed"
-            }`
-          );
+          const training = data.train_started
+            ? "Training started in the background."
+            : "Training already running; a new run is queued after it.";
+          alert(`✅ ${data.saved} images saved.\n${training}`);
+          if (data.train_started || data.train_queued) pollTrainStatus();
         } else {
           alert("❌ Upload failed: " + data.message);
         }
@@ -211,6 +211,21 @@ document.addEventListener("DOMContentLoaded", () => {
         alert("❌ Upload error. Please retry.");
       }
     }
+
+    // Poll until the background training run finishes
+    async function pollTrainStatus() {
+      try {
+        const res = await fetch("/admin/train_status");
+        const st = await res.json();
+        if (st.ok && st.running) {
+          setTimeout(pollTrainStatus, 2000);
+          return;
+        }
+        alert(`Training: ${st.train_ok ? "✅ Done" : "❌ Failed"}${st.train_msg ? "\n" + st.train_msg : ""}`);
+      } catch (err) {
+        console.error("Train status error:", err);
+      }
+    }
   }
 
   // ============================================================
@@ -3,23 +3,16 @@
 # Automated route/button/link test for Flask Face Attendance System
 # ============================================================
 
+import os
+import joblib
+import numpy as np
+import cv2
 import pytest
-from app import app, init_db, create_user, authenticate
+import app as app_module
+import trainer
+from app import create_user, authenticate
 from db import get_conn
 
-# ------------------------------------------------------------
-# Fixtures
-# ------------------------------------------------------------
-@pytest.fixture(scope="module")
-def client():
-    """Setup Flask test client and DB."""
-    init_db()
-    app.config["TESTING"] = True
-    app.secret_key = "test_secret"
-    with app.test_client() as client:
-        yield client
-
-
 # ------------------------------------------------------------
 # Utility: ensure at least one admin and one user exist
 # ------------------------------------------------------------
@@ -27,13 +20,15 @@ def _ensure_default_users():
     """Create a test admin and test user if they don’t exist."""
     conn = get_conn()
     cur = conn.cursor()
-    cur.execute("SELECT COUNT(*) FROM users WHERE username='test_admin'")
-    if cur.fetchone()[0] == 0:
+    # one round-trip for both presence checks
+    cur.execute("SELECT username FROM users WHERE username IN (%s, %s)", ("test_admin", "test_user"))
+    present = {row[0] for row in cur.fetchall()}
+    cur.close()
+    conn.close()
+    if "test_admin" not in present:
         create_user("test_admin", "admin123", "admin", face_id=1, name="Admin Tester")
-    cur.execute("SELECT COUNT(*) FROM users WHERE username='test_user'")
-    if cur.fetchone()[0] == 0:
+    if "test_user" not in present:
         create_user("test_user", "user123", "user", face_id=2, name="User Tester")
-    conn.close()
 
 
 # ------------------------------------------------------------
@@ -44,100 +39,136 @@ def login(client, username, password):
 
 
 # ------------------------------------------------------------
-# Button / route tests
+# Fixtures
 # ------------------------------------------------------------
-def test_all_buttons_and_links(client):
-    """Check every important route returns expected HTML."""
+@pytest.fixture(scope="module", autouse=True)
+def default_users(_app):
     _ensure_default_users()
 
-    # ----------------------------
-    # 1️⃣ Anonymous user
-    # ----------------------------
-    resp = client.get("/", follow_redirects=True)
-    assert resp.status_code == 200
-    assert b"Facial Recognition Attendance System" in resp.data
-    print("✅ Homepage OK")
 
-    # Check login page
-    resp = client.get("/login")
-    assert resp.status_code == 200 and b"Login" in resp.data
-    print("✅ Login form OK")
+@pytest.fixture
+def as_admin(client):
+    """client logged in as test_admin; only posts /login when the session isn't already admin."""
+    with client.session_transaction() as sess:
+        user = sess.get("user") or {}
+    if user.get("username") != "test_admin":
+        resp = login(client, "test_admin", "admin123")
+        assert b"Logged in as" in resp.data
+    return client
 
-    # Check signup page
-    resp = client.get("/signup")
-    assert resp.status_code == 200 and b"Signup" in resp.data
-    print("✅ Signup form OK")
 
-    # Attendance form should be visible (no login yet)
-    resp = client.get("/attendance/mark_form")
+# ------------------------------------------------------------
+# Button / route tests
+# ------------------------------------------------------------
+ANONYMOUS_PAGES = [
+    ("/", b"Facial Recognition Attendance System"),
+    ("/login", b"Login"),
+    ("/signup", b"Signup"),
+    # attendance form should be visible (no login yet)
+    ("/attendance/mark_form", None),
+]
+
+ADMIN_PAGES = [
+    ("/admin", b"Users"),
+    ("/admin/upload", b"Bulk upload"),
+    ("/admin/live_capture", b"Live capture"),
+    ("/admin/gallery", b"Gallery"),
+    # attendance records CSV (admin only)
+    ("/attendance/records", None),
+]
+
+
+@pytest.mark.parametrize("path, expected", ANONYMOUS_PAGES)
+def test_anonymous_pages(client, path, expected):
+    with client.session_transaction() as sess:
+        sess.clear()
+    # pages render directly; only follow when the body is checked
+    resp = client.get(path, follow_redirects=expected is not None)
     assert resp.status_code == 200
-    print("✅ Attendance form OK")
+    if expected:
+        assert expected in resp.data
 
-    # ----------------------------
-    # 2️⃣ Login as normal user
-    # ----------------------------
+
+def test_user_login_dashboard_history_logout(client):
     resp = login(client, "test_user", "user123")
     assert b"Logged in as" in resp.data
-    print("✅ Login as user OK")
 
     # Visit dashboard
     resp = client.get("/")
     assert b"Dashboard" in resp.data
-    print("✅ Dashboard after login OK")
 
     # Visit My Attendance
-    resp = client.get("/attendance/history", follow_redirects=True)
+    resp = client.get("/attendance/history")
     assert resp.status_code == 200
-    print("✅ Attendance history OK")
 
-    # Logout
-    resp = client.get("/logout", follow_redirects=True)
-    assert b"Logged out" in resp.data or resp.status_code == 200
-    print("✅ Logout OK")
+    # Logout (redirects home; no need to render it)
+    resp = client.get("/logout")
+    assert resp.status_code in (200, 302)
 
-    # ----------------------------
-    # 3️⃣ Login as Admin
-    # ----------------------------
-    resp = login(client, "test_admin", "admin123")
-    assert b"Logged in as" in resp.data
-    print("✅ Login as admin OK")
-
-    # Admin Dashboard
-    resp = client.get("/admin", follow_redirects=True)
-    assert resp.status_code == 200 and b"Users" in resp.data
-    print("✅ Admin dashboard OK")
-
-    # Admin Upload
-    resp = client.get("/admin/upload", follow_redirects=True)
-    assert b"Bulk upload" in resp.data
-    print("✅ Admin bulk upload OK")
-
-    # Admin Live Capture
-    resp = client.get("/admin/live_capture", follow_redirects=True)
-    assert b"Live capture" in resp.data
-    print("✅ Admin live capture OK")
-
-    # Admin Gallery
-    resp = client.get("/admin/gallery", follow_redirects=True)
-    assert b"Gallery" in resp.data
-    print("✅ Admin gallery OK")
-
-    # Admin Evaluate
-    resp = client.get("/admin/evaluate", follow_redirects=True)
-    assert resp.status_code == 200
-    print("✅ Admin evaluate route OK")
-
-    # Admin Train
-    resp = client.get("/admin/train", follow_redirects=True)
-    assert resp.status_code == 200
-    print("✅ Admin train model OK")
 
-    # Attendance records CSV (admin only)
-    resp = client.get("/attendance/records", follow_redirects=True)
+@pytest.mark.parametrize("path, expected", ADMIN_PAGES)
+def test_admin_pages(as_admin, path, expected):
+    resp = as_admin.get(path, follow_redirects=expected is not None)
     assert resp.status_code == 200
-    print("✅ Attendance CSV export OK")
-
-    # ----------------------------
-    # ✅ All buttons & links OK
-    # ----------------------------
-    print("\n🎉 ALL ROUTES AND BUTTONS TESTED SUCCESSFULLY 🎉")
+    if expected:
+        assert expected in resp.data
+
+
+# evaluation and training run the recognizer over every training image;
+# skip them in quick runs with: pytest -m "not slow"
+@pytest.mark.slow
+def test_admin_evaluate(as_admin):
+    # flashes the result and redirects to the dashboard
+    resp = as_admin.get("/admin/evaluate")
+    assert resp.status_code in (200, 302)
+
+
+@pytest.mark.slow
+def test_trained_model_available(trained_model):
+    # /admin/train itself is covered by test_mini_project; reuse that model here
+    assert trained_model, "no trained model on disk"
+
+
+@pytest.mark.slow
+def test_retrain_while_predictor_loaded(trained_model, monkeypatch):
+    # the sklearn model is memory-mapped, so retraining must not rewrite it under a live predictor
+    face = app_module.preprocess_img_np(app_module.read_gray_image(app_module.list_all_training_images()[0]))
+    lbph, _ = app_module._load_predictor()
+    with monkeypatch.context() as m:
+        m.setattr(app_module, "MODEL_PATH", "models/_missing.yml")  # force the sklearn branch
+        knn, err = app_module._load_predictor()
+    assert knn is not None and knn.kind == "sklearn", err
+    before = knn.predict(face)
+
+    ok, msg = app_module.run_training()
+    assert ok, msg
+
+    assert knn.predict(face) == before
+    if lbph is not None:
+        lbph.predict(face)
+    fresh, err = app_module.ensure_predictor()
+    assert fresh is not None, err
+    fresh.predict(face)
+
+
+@pytest.mark.slow
+def test_knn_matches_labels_beyond_pca_cap(tmp_path, monkeypatch):
+    # more images than SKLEARN_PCA_COMPONENTS, so the PCA projection is lossy
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(trainer.TRAINING_FOLDER)
+    rng = np.random.default_rng(0)
+    n_ids, per_id = 30, 10
+    assert n_ids * per_id > trainer.SKLEARN_PCA_COMPONENTS
+    for fid in range(1, n_ids + 1):
+        base = rng.integers(0, 256, (200, 200))
+        for i in range(per_id):
+            img = np.clip(base + rng.normal(0, 12, base.shape), 0, 255).astype(np.uint8)
+            cv2.imwrite(os.path.join(trainer.TRAINING_FOLDER, f"User.{fid}.{i}.jpg"), img)
+
+    ok, msg = trainer.train_model()
+    assert ok, msg
+    pixels, labels = trainer._load_training_pixels(trainer._collect_training_images())
+    saved = joblib.load(trainer.SKLEARN_MODEL_PATH)
+    assert saved["pca"].n_components_ == trainer.SKLEARN_PCA_COMPONENTS
+    Z = saved["pca"].transform(pixels.reshape(len(pixels), -1).astype(np.float32))
+    assert (saved["model"].predict(Z) == labels).all()
@@ -17,6 +17,19 @@ def save_db_error_snapshot(message: str):
     print(f"⚠️ Saved DB error message to {path}")
 
 
+@pytest.fixture(scope="module")
+def db_conn():
+    """One MySQL connection shared by this module's tests. If connecting fails the
+    exception is yielded instead, so the test reports it as a failure, not a setup error."""
+    try:
+        conn = get_conn()
+    except Exception as e:
+        yield e
+        return
+    yield conn
+    conn.close()
+
+
 def test_db_connection():
     """Verify that MySQL connection works correctly."""
     try:
@@ -30,19 +43,19 @@ def test_db_connection():
     assert ok, f"❌ Database connection failed: {msg or 'Unknown error'}"
 
 
-def test_get_conn_and_cursor():
+def test_get_conn_and_cursor(db_conn):
     """Ensure that get_conn() returns a working connection and cursor."""
     try:
-        conn = get_conn()
-        assert conn is not None, "❌ get_conn() returned None"
+        if isinstance(db_conn, Exception):
+            raise db_conn
+        assert db_conn is not None, "❌ get_conn() returned None"
 
-        cursor = conn.cursor()
+        cursor = db_conn.cursor()
         cursor.execute("SELECT DATABASE()")
         dbname = cursor.fetchone()[0]
         print(f"✅ Connected to database: {dbname}")
 
         cursor.close()
-        conn.close()
     except Exception as e:
         save_db_error_snapshot(f"get_conn() failed: {e}")
         pytest.fail(f"❌ get_conn() failed: {e}")
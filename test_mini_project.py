@@ -6,10 +6,12 @@
 import os
 import io
 import base64
+import errno
+import hashlib
 import random
 import string
 import pytest
-from app import app, init_db
+from db import get_conn
 
 # ============================================================
 # Helper utilities
@@ -19,16 +21,6 @@ def random_username(prefix="user"):
     """Generate a random username to avoid conflicts."""
     return prefix + "_" + ''.join(random.choices(string.ascii_lowercase + string.digits, k=6))
 
-def fake_image_bytes():
-    """Create a small fake grayscale image in memory (200x200)."""
-    from PIL import Image
-    import numpy as np
-    arr = np.random.randint(0, 255, (200, 200), dtype=np.uint8)
-    im = Image.fromarray(arr)
-    buf = io.BytesIO()
-    im.save(buf, format="JPEG")
-    return buf.getvalue()
-
 def save_failure_snapshot(test_name: str, response):
     """Save failed page HTML to /test_artifacts for debugging."""
     os.makedirs("test_artifacts", exist_ok=True)
@@ -46,13 +38,10 @@ def save_failure_snapshot(test_name: str, response):
 # ============================================================
 
 @pytest.fixture(scope="module")
-def client():
-    """Flask test client with initialized DB."""
-    init_db()
-    app.config['TESTING'] = True
-    app.secret_key = "test_secret"
-    with app.test_client() as client:
-        yield client
+def admin_client(client):
+    """Shared client logged in once as admin_test for the admin tests."""
+    client.post("/login", data={"username": "admin_test", "password": "admin123"}, follow_redirects=True)
+    yield client
 
 # ============================================================
 # Basic route tests
@@ -87,6 +76,29 @@ def test_signup_and_login_flow(client):
         save_failure_snapshot("login", resp_login)
     assert b"Logged in as" in resp_login.data
 
+def test_login_upgrades_legacy_sha256_hash(client):
+    """A bare sha256 hex hash still logs in and is rewritten as PBKDF2."""
+    username = random_username("legacy")
+    client.post("/signup", data={"username": username, "password": "old123", "role": "user"}, follow_redirects=True)
+    conn = get_conn()
+    try:
+        cur = conn.cursor()
+        cur.execute("UPDATE users SET password_hash = %s WHERE username = %s",
+                    (hashlib.sha256(b"old123").hexdigest(), username))
+        conn.commit()
+
+        resp = client.post("/login", data={"username": username, "password": "old123"}, follow_redirects=True)
+        if b"Logged in as" not in resp.data:
+            save_failure_snapshot("legacy_login", resp)
+        assert b"Logged in as" in resp.data
+
+        cur.execute("SELECT password_hash FROM users WHERE username = %s", (username,))
+        (stored,) = cur.fetchone()
+        cur.close()
+    finally:
+        conn.close()
+    assert stored.startswith("pbkdf2:sha256:")
+
 def test_attendance_page_loads(client):
     resp = client.get("/attendance/mark_form")
     if resp.status_code != 200:
@@ -121,24 +133,20 @@ def test_admin_signup_and_login(client):
         save_failure_snapshot("admin_login", resp_login)
     assert b"Logged in as" in resp_login.data
 
-def test_admin_access_dashboard(client):
+def test_admin_access_dashboard(admin_client):
     """Admin dashboard should be accessible after admin login."""
-    client.post("/login", data={"username": "admin_test", "password": "admin123"}, follow_redirects=True)
-    resp = client.get("/admin", follow_redirects=True)
+    resp = admin_client.get("/admin", follow_redirects=True)
     if resp.status_code != 200:
         save_failure_snapshot("admin_dashboard", resp)
     assert resp.status_code == 200
     assert b"Users" in resp.data or b"Admin Dashboard" in resp.data
 
-def test_admin_live_capture_upload(client):
+def test_admin_live_capture_upload(admin_client, jpeg_bytes):
     """Simulate live capture image upload as admin."""
-    client.post("/login", data={"username": "admin_test", "password": "admin123"}, follow_redirects=True)
-
-    img_bytes = fake_image_bytes()
-    b64 = base64.b64encode(img_bytes).decode("utf-8")
+    b64 = base64.b64encode(jpeg_bytes).decode("utf-8")
     payload = {"face_id": 1, "images": [b64 for _ in range(5)]}
 
-    resp = client.post("/admin/live_capture_upload", json=payload)
+    resp = admin_client.post("/admin/live_capture_upload", json=payload)
     if resp.status_code != 200:
         save_failure_snapshot("admin_live_capture", resp)
     data = resp.get_json()
@@ -146,23 +154,43 @@ def test_admin_live_capture_upload(client):
     assert data["ok"] is True
     assert data["saved"] >= 1
 
-def test_admin_bulk_upload(client):
-    """Upload a few fake JPEGs to /admin/upload."""
-    client.post("/login", data={"username": "admin_test", "password": "admin123"}, follow_redirects=True)
+def test_admin_live_capture_upload_rejects_bad_face_id(admin_client, jpeg_bytes):
+    """A non-numeric face_id is refused before anything is looked up or saved."""
+    b64 = base64.b64encode(jpeg_bytes).decode("utf-8")
+    resp = admin_client.post("/admin/live_capture_upload", json={"face_id": "abc", "images": [b64]})
+    assert resp.status_code == 400
+    assert resp.get_json()["ok"] is False
+
+def test_admin_live_capture_reports_failed_writes(admin_client, jpeg_bytes, monkeypatch):
+    """Images that fail to reach disk are reported as errors, not counted as saved."""
+    import app
+
+    def disk_full(path, data):
+        raise OSError(errno.ENOSPC, "No space left on device")
+
+    monkeypatch.setattr(app, "_write_bytes", disk_full)
+    monkeypatch.setattr(app, "start_background_training", lambda: True)
+    b64 = base64.b64encode(jpeg_bytes).decode("utf-8")
+    resp = admin_client.post("/admin/live_capture_upload", json={"face_id": 1, "images": [b64, b64]})
+    data = resp.get_json()
+    assert resp.status_code == 200
+    assert data["saved"] == 0
+    assert len(data["errors"]) == 2
 
-    files = [(io.BytesIO(fake_image_bytes()), f"img_{i}.jpg") for i in range(3)]
+def test_admin_bulk_upload(admin_client, jpeg_bytes):
+    """Upload a few fake JPEGs to /admin/upload."""
+    files = [(io.BytesIO(jpeg_bytes), f"img_{i}.jpg") for i in range(3)]
     data = {"face_id": "1", "files": files}
 
-    resp = client.post("/admin/upload", data=data, content_type="multipart/form-data", follow_redirects=True)
+    resp = admin_client.post("/admin/upload", data=data, content_type="multipart/form-data", follow_redirects=True)
     if b"Saved" not in resp.data:
         save_failure_snapshot("admin_bulk_upload", resp)
     assert resp.status_code == 200
     assert b"Saved" in resp.data
 
-def test_admin_train_model(client):
+def test_admin_train_model(admin_client):
     """Trigger model training route."""
-    client.post("/login", data={"username": "admin_test", "password": "admin123"}, follow_redirects=True)
-    resp = client.get("/admin/train", follow_redirects=True)
+    resp = admin_client.get("/admin/train", follow_redirects=True)
     if resp.status_code != 200:
         save_failure_snapshot("admin_train", resp)
     assert resp.status_code == 200
@@ -172,7 +200,7 @@ def test_admin_train_model(client):
 # Attendance workflow simulation
 # ============================================================
 
-def test_user_mark_attendance_fails_without_model(client):
+def test_user_mark_attendance_fails_without_model(client, jpeg_bytes):
     """Ensure attendance endpoint gives appropriate error for dummy image."""
     username = random_username("attend")
     client.post("/signup", data={
@@ -185,7 +213,7 @@ def test_user_mark_attendance_fails_without_model(client):
 
     client.post("/login", data={"username": username, "password": "abc123"}, follow_redirects=True)
 
-    dummy_b64 = base64.b64encode(fake_image_bytes()).decode("utf-8")
+    dummy_b64 = base64.b64encode(jpeg_bytes).decode("utf-8")
     resp = client.post("/attendance/mark", json={"image_base64": dummy_b64})
     if resp.status_code not in (200, 400, 500):
         save_failure_snapshot("attendance_mark", resp)
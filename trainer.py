@@ -1,78 +1,174 @@
 import os
+import re
 import glob
-import pickle
+import hashlib
+import tempfile
+import joblib
 from pathlib import Path
 from typing import List, Tuple
+from concurrent.futures import ThreadPoolExecutor
 
 import cv2
 import numpy as np
+from sklearn.decomposition import PCA
 from sklearn.neighbors import KNeighborsClassifier
 
 # Paths expected by the main app
 MODEL_PATH = "models/trained_model.yml"
 SKLEARN_MODEL_PATH = "models/sklearn_model.pkl"
 TRAINING_FOLDER = "training_images"
+IMAGE_SIZE = (200, 200)
+# KNN runs on a PCA projection of the 40,000 raw pixels rather than the pixels themselves
+SKLEARN_PCA_COMPONENTS = 256
+# ball-tree queries are sub-linear on low-dimensional data but degrade to worse
+# than a brute-force scan above a few dozen dimensions
+BALL_TREE_MAX_DIMS = 30
+
+
+# nothing this small can be a decodable face image (truncated upload, .DS_Store, ...)
+MIN_IMAGE_BYTES = 128
+
+
+def read_gray_image(path: str):
+    """cv2.imread in grayscale, skipping missing or too-small files without opening a decoder."""
+    try:
+        if os.stat(path).st_size < MIN_IMAGE_BYTES:
+            return None
+    except OSError:
+        return None
+    return cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+
+
+def preprocess_img(img, size=IMAGE_SIZE):
+    """Equalize and resize a grayscale image the same way the app does before predicting."""
+    if img is None:
+        return None
+    if img.dtype != np.uint8:
+        img = img.astype(np.uint8)
+    img = cv2.equalizeHist(img)
+    return cv2.resize(img, size)
+
+
+# "User.<face_id>....jpg" -> face_id (same rule as the old split('.')[1].isdigit() check)
+_FACE_ID_RE = re.compile(r'^[^.]+\.(\d+)(?:\.|$)')
+
+
+def parse_face_id(fname: str):
+    """face_id encoded in a training image's file name, or None if it has none."""
+    m = _FACE_ID_RE.match(os.path.basename(fname))
+    return int(m.group(1)) if m else None
 
 
 def _collect_training_images() -> List[Tuple[int, str]]:
     """Return list of (face_id, filepath) for files under training_images.
     Expected filename format: User.<face_id>....jpg
     """
-    files = sorted(glob.glob(os.path.join(TRAINING_FOLDER, "*")))
     out = []
-    for p in files:
-        name = os.path.basename(p)
-        parts = name.split('.')
-        if len(parts) < 2:
-            continue
-        if not parts[1].isdigit():
-            continue
-        try:
-            fid = int(parts[1])
-        except Exception:
-            continue
-        out.append((fid, p))
+    try:
+        with os.scandir(TRAINING_FOLDER) as it:
+            for e in it:
+                fid = parse_face_id(e.name)
+                if fid is not None and e.is_file():
+                    out.append((fid, e.path))
+    except FileNotFoundError:
+        return []
+    out.sort(key=lambda t: t[1])
     return out
 
 
-def _load_images_for_lbph(pairs: List[Tuple[int, str]]):
-    imgs = []
-    labels = []
-    for fid, p in pairs:
-        img = cv2.imread(p, cv2.IMREAD_GRAYSCALE)
-        if img is None:
-            continue
-        # Expect trainer images already 200x200 and equalized; but defensively resize & equalize
+def _prepare_one(fid: int, p: str):
+    """Decode one training image; returns (fid, image) or (fid, None) if unreadable."""
+    img = read_gray_image(p)  # already uint8
+    if img is None:
+        return fid, None
+    # Expect trainer images already 200x200 and equalized; but defensively resize & equalize.
+    # Resize first so equalization only touches 200x200 pixels, and equalize in place.
+    try:
+        if img.shape != (IMAGE_SIZE[1], IMAGE_SIZE[0]):
+            img = cv2.resize(img, IMAGE_SIZE, interpolation=cv2.INTER_AREA)
+        cv2.equalizeHist(img, img)
+    except Exception:
+        pass
+    return fid, img
+
+
+def _prepare_all(pairs: List[Tuple[int, str]]):
+    """Yield (fid, image) for readable files, in order. imread/equalizeHist/resize
+    release the GIL, so a thread pool decodes across cores without pickling arrays."""
+    with ThreadPoolExecutor(max_workers=os.cpu_count() or 4) as ex:
+        for fid, img in ex.map(lambda fp: _prepare_one(*fp), pairs):
+            if img is not None:
+                yield fid, img
+
+
+def _load_training_pixels(pairs: List[Tuple[int, str]]):
+    """Decode every training image into one contiguous uint8 (N, H, W) block.
+    LBPH trains on views into it and KNN on its flattened rows, so both models
+    share a single decode. Returns (None, None) when nothing could be read."""
+    X = np.empty((len(pairs), IMAGE_SIZE[1], IMAGE_SIZE[0]), dtype=np.uint8)
+    y = np.empty(len(pairs), dtype=np.int32)
+    k = 0
+    for fid, img in _prepare_all(pairs):
+        X[k] = img
+        y[k] = int(fid)
+        k += 1
+    if not k:
+        return None, None
+    return X[:k], y[:k]
+
+
+def _dataset_cache_path(pairs: List[Tuple[int, str]]) -> str:
+    """Cache file keyed by every training file's (path, mtime, size)."""
+    stats = []
+    for _, p in pairs:
+        st = os.stat(p)
+        stats.append((p, st.st_mtime, st.st_size))
+    # bump when _prepare_one's pipeline or the cached layout changes so old caches aren't reused
+    stats.append(("pipeline", 3))
+    key = hashlib.sha1(repr(stats).encode()).hexdigest()
+    return os.path.join(os.path.dirname(SKLEARN_MODEL_PATH), f"_cache_{key}.npz")
+
+
+def _load_training_pixels_cached(pairs: List[Tuple[int, str]]):
+    """_load_training_pixels, reusing the last result while training_images/ is unchanged."""
+    try:
+        path = _dataset_cache_path(pairs)
+    except OSError:
+        return _load_training_pixels(pairs)
+    if os.path.exists(path):
         try:
-            img = img.astype('uint8')
-            img = cv2.equalizeHist(img)
-            img = cv2.resize(img, (200, 200))
+            with np.load(path) as data:
+                return data['X'], data['y']
         except Exception:
             pass
-        imgs.append(img)
-        labels.append(int(fid))
-    return imgs, labels
-
-
-def _load_images_for_sklearn(pairs: List[Tuple[int, str]]):
-    X = []
-    y = []
-    for fid, p in pairs:
-        img = cv2.imread(p, cv2.IMREAD_GRAYSCALE)
-        if img is None:
-            continue
+    X, y = _load_training_pixels(pairs)
+    if X is not None:
+        folder = os.path.dirname(path)
+        for old in glob.glob(os.path.join(folder, "_cache_*.npz")):
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+        np.savez(path, X=X, y=y)
+    return X, y
+
+
+def _replace_file(path: str, write):
+    """Call write(tmp) on a temp file beside path, then os.replace() it over path.
+    The app memory-maps the sklearn model and re-reads either model while serving,
+    so a rewrite in place could hand it a truncated file; a rename never does."""
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".tmp_",
+                               suffix=os.path.splitext(path)[1])  # OpenCV picks the format by extension
+    os.close(fd)
+    try:
+        write(tmp)
+        os.replace(tmp, path)
+    except BaseException:
         try:
-            img = cv2.resize(img, (200, 200))
-            img = cv2.equalizeHist(img.astype('uint8'))
-        except Exception:
+            os.remove(tmp)
+        except OSError:
             pass
-        X.append(img.flatten().astype('float32'))
-        y.append(int(fid))
-    if not X:
-        return None, None
-    X = np.vstack(X)
-    y = np.array(y, dtype=np.int32)
-    return X, y
+        raise
 
 
 def _ensure_models_dir():
@@ -92,6 +188,13 @@ def train_model() -> Tuple[bool, str]:
     if not pairs:
         return False, "No training images found in training_images/"
 
+    # decoded once (or read back from the cache) and shared by both models
+    try:
+        pixels, y = _load_training_pixels_cached(pairs)
+    except Exception as e:
+        return False, f"Training failed: could not load training images: {e}"
+    n_samples = 0 if pixels is None else len(pixels)
+
     # Try LBPH first (opencv-contrib)
     lbph_ok = False
     lbph_msg = ""
@@ -106,16 +209,15 @@ def train_model() -> Tuple[bool, str]:
                 recognizer = None
 
             if recognizer is not None:
-                imgs, labels = _load_images_for_lbph(pairs)
-                if len(imgs) >= 2:
-                    recognizer.train(imgs, np.array(labels, dtype=np.int32))
+                if n_samples >= 2:
+                    recognizer.train(list(pixels), y)
                     # write model
                     if hasattr(recognizer, 'write'):
-                        recognizer.write(MODEL_PATH)
+                        _replace_file(MODEL_PATH, recognizer.write)
                     else:
-                        recognizer.save(MODEL_PATH)
+                        _replace_file(MODEL_PATH, recognizer.save)
                     lbph_ok = True
-                    lbph_msg = f"LBPH model trained and saved to {MODEL_PATH} (samples={len(labels)})"
+                    lbph_msg = f"LBPH model trained and saved to {MODEL_PATH} (samples={n_samples})"
                 else:
                     lbph_msg = "Not enough images for LBPH (need at least 2)."
         else:
@@ -128,15 +230,24 @@ def train_model() -> Tuple[bool, str]:
     sk_ok = False
     sk_msg = ""
     try:
-        X, y = _load_images_for_sklearn(pairs)
-        if X is not None and len(X) >= 2:
-            knn = KNeighborsClassifier(n_neighbors=3)
-            knn.fit(X, y)
-            with open(SKLEARN_MODEL_PATH, 'wb') as f:
-                # save as dict for compatibility with older code
-                pickle.dump({'model': knn}, f)
+        if n_samples >= 2:
+            X = pixels.reshape(n_samples, -1).astype(np.float32)
+            # while N <= SKLEARN_PCA_COMPONENTS the projection spans all N training points,
+            # so their pairwise distances are kept exactly; beyond that it keeps the top
+            # components only and distances (and so KNN votes) are approximate. Either way
+            # queries and the stored matrix shrink by ~150x
+            pca = PCA(n_components=min(SKLEARN_PCA_COMPONENTS, *X.shape), random_state=0)
+            Z = pca.fit_transform(X)
+            del X
+            algorithm = "ball_tree" if Z.shape[1] <= BALL_TREE_MAX_DIMS else "brute"
+            knn = KNeighborsClassifier(n_neighbors=3, algorithm=algorithm, leaf_size=40)
+            knn.fit(Z, y)
+            # save as dict for compatibility with older code; uncompressed so
+            # the app can memory-map the arrays on load. The app applies 'pca' before predicting.
+            _replace_file(SKLEARN_MODEL_PATH,
+                          lambda tmp: joblib.dump({'model': knn, 'pca': pca}, tmp, compress=0))
             sk_ok = True
-            sk_msg = f"Sklearn KNN trained and saved to {SKLEARN_MODEL_PATH} (samples={len(y)})"
+            sk_msg = f"Sklearn KNN trained and saved to {SKLEARN_MODEL_PATH} (samples={len(y)}, dims={Z.shape[1]}, {algorithm})"
         else:
             sk_msg = "Not enough images for sklearn training (need at least 2)."
     except Exception as e:
@@ -11,16 +11,22 @@ import os
 import sys
 import argparse
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime
 
 # ---- optional imports guarded for clearer error messages
-def safe_import(name):
+def _try_import(name):
     try:
-        return __import__(name)
+        return __import__(name), None
     except Exception as e:
+        return None, e
+
+def safe_import(name):
+    m, e = _try_import(name)
+    if m is None:
         print(f"[FAIL] cannot import {name}: {e}")
-        return None
+    return m
 
 def status(ok, msg):
     print(("[ OK ] " if ok else "[FAIL] ") + msg)
@@ -49,8 +55,13 @@ def check_packages():
         "PIL",              # Pillow
         "sklearn"
     ]
-    for mod in needed:
-        m = safe_import(mod.split('.')[0])
+    names = [mod.split('.')[0] for mod in needed]
+    # import in parallel threads (mostly file I/O), then report in list order
+    with ThreadPoolExecutor(max_workers=len(names)) as ex:
+        results = list(ex.map(_try_import, names))
+    for name, (m, e) in zip(names, results):
+        if m is None:
+            print(f"[FAIL] cannot import {name}: {e}")
         ok_all &= m is not None
     return ok_all
 
@@ -149,6 +160,15 @@ def check_env_vars():
             print(f"[ INFO ] {k} = {shown}")
     return True
 
+_CASCADE = None
+
+def _get_cascade(cv2):
+    """Parse the Haar cascade XML once and reuse it."""
+    global _CASCADE
+    if _CASCADE is None:
+        _CASCADE = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
+    return _CASCADE
+
 def quick_face_detect(sample_path: Path):
     cv2 = safe_import("cv2")
     if cv2 is None:
@@ -159,8 +179,8 @@ def quick_face_detect(sample_path: Path):
         img = cv2.imread(str(sample_path), cv2.IMREAD_GRAYSCALE)
         if img is None:
             return status(False, "Failed to read sample image (None)")
-        cascade = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
-        faces = cascade.detectMultiScale(img, 1.3, 5)
+        # minSize prunes the smallest pyramid scales; app faces are far larger than 40px
+        faces = _get_cascade(cv2).detectMultiScale(img, 1.3, 5, minSize=(40, 40))
         return status(len(faces) > 0, f"Face detection on sample: {len(faces)} face(s) found")
     except Exception as e:
         return status(False, f"Face detection failed: {e}")
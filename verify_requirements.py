@@ -1,4 +1,5 @@
 import importlib
+from concurrent.futures import ThreadPoolExecutor
 
 packages = [
     "flask",
@@ -13,11 +14,22 @@ packages = [
 
 print("\n=== Requirements Verification ===\n")
 
-for pkg in packages:
+def _try_import(pkg):
     try:
         importlib.import_module(pkg)
-        print(f"[ OK ] {pkg} installed")
+        return True
     except Exception:
+        return False
+
+
+# imports are mostly file I/O, so threads overlap them; results print in list order
+with ThreadPoolExecutor(max_workers=len(packages)) as ex:
+    results = list(ex.map(_try_import, packages))
+
+for pkg, ok in zip(packages, results):
+    if ok:
+        print(f"[ OK ] {pkg} installed")
+    else:
         print(f"[ MISSING ] {pkg} NOT installed")
 
 print("\n= All Good \n")